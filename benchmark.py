@@ -0,0 +1,306 @@
+"""Benchmark offline do pipeline completo, sem acesso à rede.
+
+Reproduz fixtures gravadas (dados do fundamentus, histórico OHLCV e respostas do
+Gemini) por meio de clientes simulados com latência configurável, e mede a vazão,
+a latência de cada etapa e o pico de memória para cada tamanho de lista. Exemplo:
+
+    python benchmark.py --tamanhos 1 10 100 1000 --latencia-ia 0.8 --latencia-fundamentus 0.2
+
+Sem ``--fixtures``, os dados são sintéticos. Para gravar fixtures reais (com rede):
+
+    python benchmark.py --gravar --fixtures fixtures/ --acoes PETR4 VALE3 ITUB4
+
+Diretório de fixtures:
+
+    fundamentus/<ACAO>.json  snapshot do fundamentus (mesmo formato de RICHBOT_FIXTURES_FUNDAMENTUS)
+    historico.csv            barras diárias: acao, data, Open, High, Low, Close, Volume
+    respostas/<ACAO>.txt     resposta do modelo para a ação
+
+As ações do benchmark reaproveitam as fixtures em ciclo (B0000 usa a 1ª, B0001 a 2ª...),
+então poucas ações gravadas bastam para medir listas de 1000.
+"""
+import argparse
+import asyncio
+import functools
+import json
+import os
+import random
+import re
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+# O diretório dos caches do pipeline é lido na importação: o benchmark nunca usa o .cache do usuário
+os.environ.setdefault("RICHBOT_CACHE_DIR", tempfile.mkdtemp(prefix="richbot-benchmark-"))
+
+import numpy as np
+import pandas as pd
+
+import graficos
+import pipeline
+
+RESPOSTA_SINTETICA = (
+    "Os indicadores mostram rentabilidade consistente e endividamento controlado, "
+    "mas a cotação já reflete boa parte dessas qualidades.\n"
+    '{"classificacao": "Neutro", "confianca": 0.6, "fatores": ["ROIC", "P/L", "Dívida"]}'
+)
+_PADRAO_ACOES_LOTE = re.compile(r"com uma chave para cada uma destas ações: ([^\n]+)\.")
+
+
+class Fixtures:
+    """Dados que alimentam os clientes simulados, gravados em disco ou sintéticos."""
+
+    def __init__(self, diretorio=None, semente=0):
+        self.diretorio = diretorio
+        self._semente = semente
+        self.acoes = []
+        self.historico = None
+        if diretorio:
+            pasta = os.path.join(diretorio, "fundamentus")
+            if os.path.isdir(pasta):
+                self.acoes = sorted(nome[:-5] for nome in os.listdir(pasta) if nome.endswith(".json"))
+            caminho = os.path.join(diretorio, "historico.csv")
+            if os.path.exists(caminho):
+                self.historico = {acao: barras.drop(columns="acao")
+                                  for acao, barras in pd.read_csv(caminho).groupby("acao")}
+        if not self.acoes:
+            self.acoes = [f"S{i:02d}" for i in range(8)]  # Modelos sintéticos
+
+    def modelo_de(self, acao):
+        """Ação gravada usada para simular ``acao`` (B0003 -> 4ª fixture)."""
+        return self.acoes[int(acao[1:]) % len(self.acoes)]
+
+    def fundamentus(self, acao):
+        modelo = self.modelo_de(acao)
+        if self.diretorio and os.path.isdir(os.path.join(self.diretorio, "fundamentus")):
+            return pipeline.carregar_fixture_fundamentus(os.path.join(self.diretorio, "fundamentus"), modelo)
+        return pipeline._envolver_valores(self._fundamentus_sintetico(modelo))
+
+    def _fundamentus_sintetico(self, modelo):
+        gerador = random.Random(f"{self._semente}-{modelo}")
+        dados = {}
+        for _, _, caminho in pipeline.CAMPOS_IA:
+            *intermediarios, folha = caminho
+            no = dados
+            for chave in intermediarios:
+                no = no.setdefault(chave, {})
+            no[folha] = round(gerador.uniform(-50, 150), 2)
+        dados["price_information"]["date"] = date.today().isoformat()
+        return dados
+
+    def barras(self, acao, inicio):
+        modelo = self.modelo_de(acao)
+        if self.historico is not None and modelo in self.historico:
+            barras = self.historico[modelo]
+            return barras[barras["data"] >= inicio]
+        return self._barras_sinteticas(modelo, inicio)
+
+    @functools.lru_cache(maxsize=None)
+    def _barras_sinteticas(self, modelo, inicio):
+        # Passeio aleatório determinístico por modelo (gerado uma vez, fora da medição do pipeline)
+        datas = pd.bdate_range(inicio, date.today())
+        gerador = np.random.default_rng([self._semente, *modelo.encode()])
+        fechamento = 20 * np.exp(np.cumsum(gerador.normal(0, 0.02, len(datas))))
+        return pd.DataFrame({
+            "data": datas.strftime("%Y-%m-%d"), "Open": fechamento * 0.99, "High": fechamento * 1.01,
+            "Low": fechamento * 0.98, "Close": fechamento, "Volume": gerador.integers(1e5, 1e7, len(datas)),
+        })
+
+    def resposta(self, acao):
+        if self.diretorio:
+            caminho = os.path.join(self.diretorio, "respostas", f"{self.modelo_de(acao)}.txt")
+            if os.path.exists(caminho):
+                with open(caminho, encoding="utf-8") as arquivo:
+                    return arquivo.read()
+        return RESPOSTA_SINTETICA
+
+
+def _esperar(latencia, variacao):
+    return max(0.0, latencia * (1 + random.uniform(-variacao, variacao)))
+
+
+class ModeloSimulado:
+    """Imita o ``GenerativeModel`` do Gemini devolvendo as respostas das fixtures após uma latência."""
+
+    model_name = "modelo-simulado"
+
+    def __init__(self, fixtures, latencia=0.0, variacao=0.0):
+        self.fixtures = fixtures
+        self.latencia = latencia
+        self.variacao = variacao
+
+    async def generate_content_async(self, prompt_text):
+        await asyncio.sleep(_esperar(self.latencia, self.variacao))
+        lote = _PADRAO_ACOES_LOTE.search(prompt_text)
+        if lote:
+            texto = json.dumps({acao: self._item_lote(acao) for acao in lote.group(1).split(", ")})
+        else:
+            acao = re.search(r"dados da ação (\S+) e", prompt_text)
+            texto = self.fixtures.resposta(acao.group(1) if acao else "B0000")
+        return type("RespostaSimulada", (), {"text": texto})()
+
+    def _item_lote(self, acao):
+        analise, veredito = pipeline.extrair_veredito(self.fixtures.resposta(acao))
+        return {**veredito._asdict(), "analise": analise}
+
+
+def instalar_clientes(fixtures, diretorio, args):
+    """Troca os clientes globais do pipeline por simulados, com caches novos em ``diretorio``."""
+    def buscar(acao):
+        time.sleep(_esperar(args.latencia_fundamentus, args.variacao))
+        return fixtures.fundamentus(acao)
+
+    def baixar(acoes, inicio):
+        time.sleep(_esperar(args.latencia_historico, args.variacao))
+        barras = pd.concat([fixtures.barras(acao, inicio) for acao in acoes], keys=acoes, names=["acao", None])
+        return barras.reset_index(level="acao").reset_index(drop=True)[["acao", "data", *pipeline.CAMPOS_OHLCV]]
+
+    pipeline.cache_fundamentus = pipeline.CacheFundamentus(os.path.join(diretorio, "fundamentus.sqlite3"), buscar=buscar)
+    pipeline.historico_precos = pipeline.HistoricoPrecos(os.path.join(diretorio, "historico.sqlite3"), baixar=baixar)
+    pipeline.cache_respostas_ia = pipeline.CacheRespostasIA(os.path.join(diretorio, "respostas_ia.sqlite3"))
+    pipeline.ultimas_analises = pipeline.UltimasAnalises(os.path.join(diretorio, "ultimas_analises.sqlite3"))
+    pipeline.despachante_ia = pipeline.DespachanteIA(requisicoes_por_minuto=args.rpm, rajada=args.rajada,
+                                                     max_simultaneas=args.simultaneas_ia)
+    pipeline.model = ModeloSimulado(fixtures, args.latencia_ia, args.variacao)
+
+
+def executar(acoes, args):
+    """Analisa ``acoes`` como a interface faria e devolve {acao: resultado}."""
+    resultados, acao_status = {}, {}
+    if args.sequencial:
+        for acao in acoes:
+            pipeline.analisar_acao(acao, resultados, acao_status)
+    else:
+        limites = {"dados": args.workers, "grafico": args.workers}
+        pipeline.iniciar_analise(acoes, resultados, acao_status, threading.Event(), limites=limites,
+                                 lote_ia=args.lote_ia, armazem=pipeline.ArmazemResultados(), top_k=args.top_k,
+                                 detectar_mudancas=not args.completo)
+    if args.figuras:
+        for acao, resultado in resultados.items():
+            if "erro" not in resultado:
+                graficos.figura_do_resultado(acao, resultado)
+    return resultados
+
+
+def medir(tamanho, fixtures, args, diretorio, rodada):
+    acoes = [f"B{i:04d}" for i in range(tamanho)]
+    pipeline.metricas.limpar()
+    if args.memoria:
+        tracemalloc.start()
+    inicio = time.perf_counter()
+    resultados = executar(acoes, args)
+    duracao = time.perf_counter() - inicio
+    pico = None
+    if args.memoria:
+        _, pico = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    erros = sum("erro" in resultado for resultado in resultados.values())
+    fora = sum(pipeline.fora_da_triagem(resultado) for resultado in resultados.values())
+    reaproveitadas = sum("reaproveitada" in resultado for resultado in resultados.values())
+    return {
+        "acoes": tamanho, "rodada": rodada, "segundos": duracao, "acoes_por_segundo": tamanho / duracao,
+        "pico_memoria_mb": None if pico is None else pico / 2**20, "erros": erros, "fora_da_triagem": fora,
+        "reaproveitadas": reaproveitadas,
+        "etapas": pipeline.metricas.resumo().to_dict("records"),
+        "contadores": pipeline.metricas.contadores(),
+    }
+
+
+def gravar_fixtures(acoes, diretorio):
+    """Grava fixtures a partir das fontes reais (fundamentus, Yahoo e Gemini). Requer rede."""
+    os.makedirs(os.path.join(diretorio, "fundamentus"), exist_ok=True)
+    os.makedirs(os.path.join(diretorio, "respostas"), exist_ok=True)
+
+    def desembrulhar(obj):
+        if isinstance(obj, dict):
+            return {chave: desembrulhar(valor) for chave, valor in obj.items()}
+        return getattr(obj, "value", obj)
+
+    for acao in acoes:
+        dados = pipeline.buscar_dados_fundamentus(acao)
+        if dados is None:
+            continue
+        with open(os.path.join(diretorio, "fundamentus", f"{acao}.json"), "w", encoding="utf-8") as arquivo:
+            json.dump(desembrulhar(dados), arquivo, ensure_ascii=False, indent=2, default=str)
+        registro = pipeline.preparar_dados_para_ia(dados, acao)
+        resposta = (pipeline.model or pipeline.obter_modelo()).generate_content(pipeline.montar_prompt(registro))
+        with open(os.path.join(diretorio, "respostas", f"{acao}.txt"), "w", encoding="utf-8") as arquivo:
+            arquivo.write(resposta.text)
+    inicio = (date.today() - timedelta(days=pipeline.DIAS_HISTORICO)).isoformat()
+    pipeline._baixar_yfinance(acoes, inicio).to_csv(os.path.join(diretorio, "historico.csv"), index=False)
+    print(f"Fixtures gravadas em {diretorio}")
+
+
+def imprimir(medicao):
+    memoria = "" if medicao["pico_memoria_mb"] is None else f", pico de memória {medicao['pico_memoria_mb']:.1f} MB"
+    print(f"\n{medicao['acoes']} ações ({medicao['rodada']}): {medicao['segundos']:.2f}s, "
+          f"{medicao['acoes_por_segundo']:.1f} ações/s{memoria}, {medicao['erros']} erros, "
+          f"{medicao['fora_da_triagem']} fora da triagem, {medicao['reaproveitadas']} sem mudanças")
+    etapas = pd.DataFrame(medicao["etapas"])
+    if not etapas.empty:
+        print(etapas.round(4).to_string(index=False))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark offline do pipeline de análise.")
+    parser.add_argument("--tamanhos", nargs="+", type=int, default=[1, 10, 100, 1000],
+                        help="Quantidades de ações a analisar (padrão: %(default)s)")
+    parser.add_argument("--fixtures", help="Diretório de fixtures gravadas (padrão: dados sintéticos)")
+    parser.add_argument("--latencia-fundamentus", type=float, default=0.05, help="Segundos por ação (padrão: %(default)s)")
+    parser.add_argument("--latencia-historico", type=float, default=0.5, help="Segundos por download em lote (padrão: %(default)s)")
+    parser.add_argument("--latencia-ia", type=float, default=0.5, help="Segundos por requisição ao modelo (padrão: %(default)s)")
+    parser.add_argument("--variacao", type=float, default=0.2, help="Variação relativa das latências (padrão: %(default)s)")
+    parser.add_argument("--rpm", type=float, default=60000, help="Cota de requisições por minuto ao modelo (padrão: %(default)s)")
+    parser.add_argument("--rajada", type=int, default=pipeline.RAJADA_IA, help="Rajada da cota (padrão: %(default)s)")
+    parser.add_argument("--simultaneas-ia", type=int, default=pipeline.MAX_SIMULTANEAS_IA,
+                        help="Requisições ao modelo em andamento (padrão: %(default)s)")
+    parser.add_argument("--workers", type=int, default=pipeline.LIMITES_ETAPAS["dados"],
+                        help="Threads das etapas de dados e de gráfico (padrão: %(default)s)")
+    parser.add_argument("--lote-ia", action="store_true", default=pipeline.MODO_LOTE_IA, help="Várias ações por requisição")
+    parser.add_argument("--top-k", type=int, default=pipeline.TOP_K_IA,
+                        help="Envia à IA só as K ações mais bem pontuadas pela triagem (0 = todas)")
+    parser.add_argument("--completo", action="store_true",
+                        help="Desliga a detecção de mudanças (a rodada quente reanalisa tudo)")
+    parser.add_argument("--sequencial", action="store_true", help="Usa analisar_acao, uma ação por vez")
+    parser.add_argument("--figuras", action="store_true", help="Também monta as figuras do plotly")
+    parser.add_argument("--quente", action="store_true", help="Repete cada tamanho com os caches já preenchidos")
+    parser.add_argument("--sem-memoria", dest="memoria", action="store_false",
+                        help="Não mede o pico de memória (o tracemalloc deixa o pipeline mais lento)")
+    parser.add_argument("--semente", type=int, default=0, help="Semente dos dados e das latências")
+    parser.add_argument("--saida", help="Grava as medições em JSON")
+    parser.add_argument("--gravar", action="store_true", help="Grava fixtures reais em --fixtures (usa a rede) e sai")
+    parser.add_argument("--acoes", nargs="+", default=pipeline.acoes[:10], help="Ações gravadas por --gravar")
+    args = parser.parse_args(argv)
+
+    if args.gravar:
+        if not args.fixtures:
+            parser.error("--gravar exige --fixtures")
+        gravar_fixtures(args.acoes, args.fixtures)
+        return 0
+
+    random.seed(args.semente)
+    fixtures = Fixtures(args.fixtures, args.semente)
+    medicoes = []
+    for tamanho in args.tamanhos:
+        diretorio = tempfile.mkdtemp(prefix=f"richbot-benchmark-{tamanho}-")
+        try:
+            instalar_clientes(fixtures, diretorio, args)
+            rodadas = ["fria", "quente"] if args.quente else ["fria"]
+            for rodada in rodadas:
+                medicoes.append(medir(tamanho, fixtures, args, diretorio, rodada))
+                imprimir(medicoes[-1])
+        finally:
+            shutil.rmtree(diretorio, ignore_errors=True)
+
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as arquivo:
+            json.dump({"parametros": vars(args), "medicoes": medicoes}, arquivo, ensure_ascii=False, indent=2)
+        print(f"\nMedições gravadas em {args.saida}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,136 @@
+"""Gráficos das ações analisadas, montados com o plotly a partir de ``obter_dados_grafico``.
+
+Não depende do Streamlit: o benchmark também monta as figuras.
+"""
+import os # Para os limites por variável de ambiente
+import numpy as np # Para a redução de pontos
+
+from pipeline import metricas, registrar_erro
+
+
+# Redução de pontos dos gráficos quando muitas ações aparecem na mesma página
+LIMIAR_GRAFICOS_REDUZIDOS = int(os.environ.get("RICHBOT_LIMIAR_GRAFICOS_REDUZIDOS", 10))  # Nº de gráficos na página
+PONTOS_GRAFICO_REDUZIDO = int(os.environ.get("RICHBOT_PONTOS_GRAFICO", 120))
+
+def indices_lttb(valores, max_pontos):
+    """Índices escolhidos pelo Largest-Triangle-Three-Buckets para representar a série com ``max_pontos``."""
+    n = len(valores)
+    if max_pontos >= n or max_pontos < 3:
+        return np.arange(n)
+    y = np.nan_to_num(np.asarray(valores, dtype=np.float64))
+    x = np.arange(n, dtype=np.float64)
+    limites = np.linspace(1, n - 1, max_pontos - 1).astype(int)  # Baldes entre o primeiro e o último ponto
+    indices = np.empty(max_pontos, dtype=np.int64)
+    indices[0], indices[-1] = 0, n - 1
+    anterior = 0
+    for i in range(max_pontos - 2):
+        inicio, fim = limites[i], limites[i + 1]
+        # Média do balde seguinte (ou o último ponto, para o último balde)
+        prox_inicio, prox_fim = fim, limites[i + 2] if i + 2 < len(limites) else n
+        media_x, media_y = x[prox_inicio:prox_fim].mean(), y[prox_inicio:prox_fim].mean()
+        areas = np.abs((x[anterior] - media_x) * (y[inicio:fim] - y[anterior])
+                       - (x[anterior] - x[inicio:fim]) * (media_y - y[anterior]))
+        anterior = inicio + int(np.argmax(areas))
+        indices[i + 1] = anterior
+    return indices
+
+# Função para plotar o gráfico do ativo
+def plot_asset_chart(ticker, data, max_pontos=None):
+    """Cria um gráfico para um ativo específico com indicadores técnicos.
+
+    Com ``max_pontos``, todas as séries são reduzidas aos mesmos pontos escolhidos por
+    LTTB sobre o preço.
+    """
+    try:
+        # Verificar se temos dados suficientes
+        if data is None or data.get('price_series') is None or not len(data['price_series']):
+            return None
+        import plotly.graph_objects as go # Para criar os gráficos
+        from plotly.subplots import make_subplots # Para criar subplots
+
+        dates = data['dates']
+        prices = data['price_series']
+        selecao = indices_lttb(prices, max_pontos) if max_pontos else slice(None)
+        dates, prices = dates[selecao], prices[selecao]
+
+        # Criar figura com dois subplots: preço e volume
+        fig = make_subplots(rows=2, cols=1, shared_xaxes=True,
+                            vertical_spacing=0.1,
+                            subplot_titles=(f"{ticker} - Preço", "Volume"),
+                            row_heights=[0.7, 0.3])
+
+        # Adicionar série de preços
+        fig.add_trace(
+            go.Scatter(x=dates, y=prices, mode='lines', name='Preço',
+                       line=dict(color='#2962FF', width=2)),
+            row=1, col=1
+        )
+
+        # Adicionar Médias Móveis
+        ma_values = data.get('ma_values', {})
+        for ma_name, ma_value in ma_values.items():
+            if ma_name == 'MA9':
+                color = '#FF6D00'  # Laranja
+            elif ma_name == 'MA20':
+                color = '#00C853'  # Verde
+            elif ma_name == 'MA50':
+                color = '#D500F9'  # Roxo
+            else:
+                color = '#757575'  # Cinza
+
+            if len(data['price_series']) >= int(ma_name[2:]):
+                fig.add_trace(
+                    go.Scatter(x=dates, y=ma_value[selecao], mode='lines', name=ma_name,
+                                 line=dict(color=color, width=1.5, dash='dot')),
+                    row=1, col=1
+                )
+
+        # Adicionar volume, se disponível
+        if data.get('volume_series') is not None and len(data['volume_series']):
+            volumes = data['volume_series'][selecao]
+            fig.add_trace(
+                go.Bar(x=dates, y=volumes, name='Volume', marker_color='#90A4AE'),
+                row=2, col=1
+            )
+
+            # Média de volume de 20 dias (calculada junto com os demais indicadores)
+            volume_ma = data.get('volume_ma')
+            if len(data['volume_series']) >= JANELA_VOLUME and volume_ma is not None:
+                fig.add_trace(
+                    go.Scatter(x=dates, y=volume_ma[selecao], mode='lines', name='Volume MA20',
+                                 line=dict(color='#FF6D00', width=1.5)),
+                    row=2, col=1
+                )
+
+        # Adicionar marcador para RSI, se disponível
+        if 'rsi' in data and data['rsi'] is not None:
+            # Mostrar o último valor do RSI como anotação
+            fig.add_annotation(
+                x=dates[-1], y=float(prices[-1]) * 1.05,
+                text=f"RSI: {data['rsi']:.1f}",
+                showarrow=True,
+                arrowhead=1,
+                bgcolor="#FFECB3" if data['rsi'] < 30 else "#E1F5FE" # Muda a cor de fundo dependendo se está sobrecomprado ou sobrevendido
+            )
+
+        # Ajustar layout
+        fig.update_layout(
+            height=600,
+            legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
+            margin=dict(l=40, r=40, t=40, b=40),
+            hovermode="x unified",
+            template="plotly_white"
+        )
+
+        return fig
+    except Exception as e:
+        registrar_erro("figura", ticker, f"Erro ao plotar o gráfico: {e}")
+        return None
+
+# Gráfico de um resultado, montado uma única vez para cada nível de redução
+def figura_do_resultado(acao, resultado, max_pontos=None):
+    figuras = resultado.setdefault('figuras', {})
+    if max_pontos not in figuras:
+        with metricas.medir("figura", acao):
+            figuras[max_pontos] = plot_asset_chart(acao, resultado['chart_data'], max_pontos)
+    return figuras[max_pontos]
@@ -0,0 +1,72 @@
+"""Indicadores técnicos calculados de uma vez para todas as ações.
+
+As funções recebem DataFrames largos (datas x ações) de fechamento e volume, como os que
+``HistoricoPrecos.carregar`` devolve, e não dependem do Streamlit.
+"""
+import functools # Para guardar a verificação de dependências
+import importlib # Para carregar dependências opcionais
+import os # Para a escolha da implementação por variável de ambiente
+
+# Janelas dos indicadores técnicos
+JANELAS_MEDIAS = (9, 20, 50)
+JANELA_RSI = 14
+JANELA_VOLUME = 20
+MOTOR_INDICADORES = os.environ.get("RICHBOT_MOTOR_INDICADORES", "nativo")  # "nativo" (pandas) ou "ta"
+
+@functools.lru_cache(maxsize=None)
+def motor_indicadores():
+    """Verifica uma única vez qual implementação dos indicadores usar.
+
+    A implementação própria (vetorizada) é o padrão. Com ``RICHBOT_MOTOR_INDICADORES=ta``
+    a biblioteca ``ta`` é usada se estiver instalada; caso contrário, volta-se para a
+    implementação própria, sem tentar instalar nada.
+    """
+    if MOTOR_INDICADORES == "ta":
+        try:
+            importlib.import_module("ta")
+            return "ta"
+        except ImportError:
+            print("Biblioteca 'ta' não encontrada; usando a implementação própria dos indicadores.")
+    return "nativo"
+
+motor_indicadores()  # Verificação única na inicialização
+
+def _por_coluna(tabela, funcao):
+    # Aplica um indicador do ta coluna a coluna, ignorando as datas sem negociação
+    return tabela.apply(lambda serie: funcao(serie.dropna()).reindex(serie.index))
+
+def rsi_vetorizado(close, janela=JANELA_RSI):
+    """RSI de Wilder (mesma fórmula do ``ta.momentum.rsi``) para todas as colunas de uma vez."""
+    diff = close.diff()
+    # A primeira variação de cada ação conta como zero, como no ta; datas anteriores à listagem ficam vazias
+    primeira = diff.isna() & close.notna()
+    alta = diff.clip(lower=0).mask(primeira, 0.0)
+    baixa = (-diff).clip(lower=0).mask(primeira, 0.0)
+    media_alta = alta.ewm(alpha=1 / janela, min_periods=janela, adjust=False).mean()
+    media_baixa = baixa.ewm(alpha=1 / janela, min_periods=janela, adjust=False).mean()
+    rs = media_alta / media_baixa
+    return (100 - 100 / (1 + rs)).where(media_baixa != 0, 100.0).where(media_alta.notna())
+
+def calcular_indicadores(close, volume):
+    """Calcula os indicadores técnicos de todas as ações de uma só vez.
+
+    ``close`` e ``volume`` são DataFrames largos (datas x ações). Retorna um dicionário
+    ``{indicador: DataFrame}`` com o mesmo formato.
+    """
+    if motor_indicadores() == "ta":
+        ta = importlib.import_module("ta")
+        indicadores = {f"MA{janela}": _por_coluna(close, lambda s, j=janela: ta.trend.sma_indicator(s, window=j))
+                       for janela in JANELAS_MEDIAS}
+        indicadores["RSI"] = _por_coluna(close, lambda s: ta.momentum.rsi(s, window=JANELA_RSI))
+        indicadores[f"VolMA{JANELA_VOLUME}"] = _por_coluna(
+            volume, lambda s: ta.trend.sma_indicator(s, window=JANELA_VOLUME))
+        return indicadores
+
+    indicadores = {f"MA{janela}": close.rolling(janela, min_periods=janela).mean() for janela in JANELAS_MEDIAS}
+    indicadores["RSI"] = rsi_vetorizado(close)
+    indicadores[f"VolMA{JANELA_VOLUME}"] = volume.rolling(JANELA_VOLUME, min_periods=JANELA_VOLUME).mean()
+    return indicadores
+
+# Fatia os indicadores calculados em lote para uma única ação
+def indicadores_da_acao(indicadores, acao, datas):
+    return {nome: tabela[acao].reindex(datas) for nome, tabela in indicadores.items() if acao in tabela.columns}
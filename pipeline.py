@@ -0,0 +1,1973 @@
+"""Pipeline de análise das ações, sem interface e sem o runtime do Streamlit.
+
+Busca os fundamentos e o histórico, calcula os indicadores, faz a triagem e envia as
+ações ao Gemini. É usado pelo ``streamlit_app.py``, pelo ``screener.py`` e pelo
+``benchmark.py``; importar o módulo não abre os caches em disco nem inicia o despachante.
+"""
+import functools # Para guardar o cliente do Gemini
+import pandas as pd
+import numpy as np # Para os vetores dos gráficos
+# fundamentus, google.generativeai e yfinance são importados no primeiro uso (inicialização mais rápida)
+from urllib.error import HTTPError
+import threading  # Para executar a análise em segundo plano
+from concurrent.futures import Future, ThreadPoolExecutor, wait  # Para o agendador com pools limitados
+import time  # Para simular o tempo de análise
+from collections import Counter, deque, namedtuple # Para os registros extraídos de cada ação e as métricas
+from contextlib import contextmanager # Para medir a duração das etapas
+import os # Importa o módulo os para acessar variáveis de ambiente
+import json # Para ler fixtures locais
+import pickle # Para serializar os snapshots do cache
+import sqlite3 # Para o cache em disco
+import hashlib # Para a impressão digital dos pedidos ao Gemini
+import asyncio # Para o despacho das chamadas ao Gemini
+import random # Para o jitter entre tentativas
+import re # Para localizar o veredito no texto da análise
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from indicadores import JANELAS_MEDIAS, JANELA_VOLUME, calcular_indicadores, indicadores_da_acao
+
+
+api_key = "GEMINI_API_KEY"
+NOME_MODELO = 'gemini-2.0-flash'
+
+# Cliente do Gemini montado só na primeira análise e guardado enquanto o processo durar
+@functools.lru_cache(maxsize=None)
+def obter_modelo():
+    import google.generativeai as genai  # Para usar a API do Gemini
+    genai.configure(api_key=api_key)  # Substitua pela sua chave de API do Gemini
+    return genai.GenerativeModel(NOME_MODELO)
+
+model = None  # Modelo usado no lugar do cliente padrão (por exemplo, um simulado); None usa obter_modelo()
+
+# Defina a lista de ações da B3
+acoes = [
+    "ITUB4", "BBDC4", "BBAS3", "B3SA3", "SANB11", "CIEL3", "IRBR3",
+    "BBSE3", "BPAC11", "BIDI11", "PETR4", "PETR3", "PRIO3", "UGPA3",
+    "VBBR3", "RRRP3", "VALE3", "CSNA3", "USIM5", "GGBR4", "GOAU4",
+    "BRAP4", "CBAV3", "CMIG4", "ELET3", "ELET6", "ENGI11", "EQTL3",
+    "CPFE3", "EGIE3", "ENEV3", "AURE3", "TAEE11", "NEOE3", "ABEV3",
+    "MGLU3", "LREN3", "AMER3", "NTCO3", "PCAR3", "CRFB3", "ASAI3",
+    "VVAR3", "SOMA3", "AMAR3", "LJQQ3", "VIVA3", "CYRE3", "EZTC3",
+    "MRVE3", "ALSO3", "BRML3", "IGTI11", "MULT3", "TEND3", "DIRR3",
+    "EVEN3", "RENT3", "RAIL3", "CCRO3", "STBP3", "PSSA3", "AZUL4",
+    "GOLL4", "ECOR3", "MOVIDA3", "LOGN3", "RDOR3", "HAPV3", "FLRY3",
+    "HYPE3", "GNDI3", "RADL3", "PAGS3", "QUAL3", "ONCO3", "LWSA3",
+    "TOTS3", "CASH3", "MODL3", "MELI34", "POSI3", "NINJ3", "SUZB3",
+    "KLBN11", "JBSS3", "BEEF3", "MRFG3", "SLCE3", "AGRO3", "SMTO3",
+    "MDIA3", "WEGE3", "EMBR3", "BRKM5", "SBSP3", "CSAN3", "COGN3",
+    "YDUQ3", "SEQL3", "TKNO4", "MYPK3", "AZEV4"
+]
+
+# Configuração das métricas de desempenho
+MAX_AMOSTRAS_METRICAS = 20000  # Amostras guardadas (as mais antigas são descartadas)
+ARQUIVO_METRICAS = os.environ.get("RICHBOT_METRICAS", os.path.join(os.environ.get("RICHBOT_CACHE_DIR", ".cache"), "metricas.json"))
+
+class Metricas:
+    """Coleta a duração de cada etapa por ação, contadores (cache, repetições) e falhas.
+
+    ``medir`` é um gerenciador de contexto que registra a duração da etapa e se ela
+    terminou com exceção. ``resumo`` devolve p50/p95 por etapa e ``exportar`` grava
+    tudo em JSON.
+    """
+
+    def __init__(self, max_amostras=MAX_AMOSTRAS_METRICAS):
+        self._trava = threading.Lock()
+        self._amostras = deque(maxlen=max_amostras)  # (instante, etapa, acao, duracao, ok)
+        self._contadores = Counter()
+        self._erros = deque(maxlen=200)  # (instante, etapa, acao, mensagem)
+
+    @contextmanager
+    def medir(self, etapa, acao=None):
+        inicio = time.perf_counter()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            self.registrar(etapa, time.perf_counter() - inicio, acao, ok)
+
+    def registrar(self, etapa, duracao, acao=None, ok=True):
+        with self._trava:
+            self._amostras.append((time.time(), etapa, acao, duracao, ok))
+
+    def contar(self, nome, quantidade=1):
+        with self._trava:
+            self._contadores[nome] += quantidade
+
+    def registrar_erro(self, etapa, acao, mensagem):
+        with self._trava:
+            self._contadores[f"falhas.{etapa}"] += 1
+            self._erros.append((time.time(), etapa, acao, str(mensagem)))
+
+    def resumo(self):
+        """DataFrame com execuções, falhas, p50, p95 e máximo (em segundos) de cada etapa."""
+        with self._trava:
+            amostras = pd.DataFrame(list(self._amostras), columns=["instante", "etapa", "acao", "duracao", "ok"])
+        if amostras.empty:
+            return pd.DataFrame(columns=["etapa", "execucoes", "falhas", "p50", "p95", "max"])
+        grupos = amostras.groupby("etapa")
+        return pd.DataFrame({
+            "execucoes": grupos.size(),
+            "falhas": grupos["ok"].apply(lambda ok: int((~ok).sum())),
+            "p50": grupos["duracao"].quantile(0.5),
+            "p95": grupos["duracao"].quantile(0.95),
+            "max": grupos["duracao"].max(),
+        }).reset_index()
+
+    def contadores(self):
+        with self._trava:
+            return dict(self._contadores)
+
+    def taxas_de_acerto(self):
+        """Taxa de acerto de cada cache, a partir dos contadores ``<cache>.acertos/perdas``."""
+        contadores = self.contadores()
+        taxas = {}
+        for nome in {chave.rsplit(".", 1)[0] for chave in contadores if chave.endswith((".acertos", ".perdas"))}:
+            acertos = contadores.get(f"{nome}.acertos", 0)
+            total = acertos + contadores.get(f"{nome}.perdas", 0) + contadores.get(f"{nome}.obsoletos", 0)
+            if total:
+                taxas[nome] = acertos / total
+        return taxas
+
+    def exportar(self, caminho=None):
+        """Grava em JSON o resumo, os contadores, os últimos erros e as amostras por ação."""
+        caminho = caminho or ARQUIVO_METRICAS
+        with self._trava:
+            amostras = [
+                {"instante": instante, "etapa": etapa, "acao": acao, "duracao": duracao, "ok": ok}
+                for instante, etapa, acao, duracao, ok in self._amostras
+            ]
+            erros = [
+                {"instante": instante, "etapa": etapa, "acao": acao, "mensagem": mensagem}
+                for instante, etapa, acao, mensagem in self._erros
+            ]
+        conteudo = {
+            "gerado_em": datetime.now().isoformat(timespec="seconds"),
+            "resumo": self.resumo().to_dict("records"),
+            "contadores": self.contadores(),
+            "taxas_de_acerto": self.taxas_de_acerto(),
+            "erros": erros,
+            "amostras": amostras,
+        }
+        if os.path.dirname(caminho):
+            os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        with open(caminho, "w", encoding="utf-8") as arquivo:
+            json.dump(conteudo, arquivo, ensure_ascii=False, indent=2)
+        return caminho
+
+    def limpar(self):
+        with self._trava:
+            self._amostras.clear()
+            self._contadores.clear()
+            self._erros.clear()
+
+# Métricas únicas do processo (comuns ao pipeline, ao app e ao screener)
+metricas = Metricas()
+
+# Registra uma falha nas métricas, além de exibi-la no console
+def registrar_erro(etapa, acao, mensagem):
+    print(mensagem)
+    metricas.registrar_erro(etapa, acao, mensagem)
+
+# Configuração do cache em disco dos dados do fundamentus
+DIRETORIO_CACHE = os.environ.get("RICHBOT_CACHE_DIR", ".cache")
+TTL_FUNDAMENTUS = int(os.environ.get("RICHBOT_TTL_FUNDAMENTUS", 6 * 3600))  # Segundos até o snapshot ficar obsoleto
+MAX_ENTRADAS_FUNDAMENTUS = int(os.environ.get("RICHBOT_MAX_FUNDAMENTUS", 500))  # Limite LRU de ações no cache
+FIXTURES_FUNDAMENTUS = os.environ.get("RICHBOT_FIXTURES_FUNDAMENTUS")  # Diretório com <ACAO>.json para uso offline
+
+ABERTURA_PREGAO = (10, 0)  # Horário de abertura da B3 (hora, minuto), no fuso de São Paulo
+
+# Data do pregão de referência: antes da abertura vale o pregão anterior e os fins de semana
+# contam como a última sexta-feira
+def data_pregao(agora=None):
+    agora = agora or datetime.now(ZoneInfo("America/Sao_Paulo"))
+    dia = agora.date()
+    if (agora.hour, agora.minute) < ABERTURA_PREGAO:
+        dia -= timedelta(days=1)
+    while dia.weekday() >= 5:
+        dia -= timedelta(days=1)
+    return dia.isoformat()
+
+class ValorFixture:
+    """Imita os valores do fundamentus (que expõem ``.value``) para dados lidos de fixtures."""
+
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __repr__(self):
+        return repr(self.value)
+
+def _envolver_valores(obj):
+    if isinstance(obj, dict):
+        return {chave: _envolver_valores(valor) for chave, valor in obj.items()}
+    return ValorFixture(obj)
+
+# Lê os dados de uma ação a partir de um diretório de fixtures (<ACAO>.json)
+def carregar_fixture_fundamentus(diretorio, acao):
+    caminho = os.path.join(diretorio, f"{acao}.json")
+    if not os.path.exists(caminho):
+        registrar_erro("fundamentus", acao, f"Erro ao obter dados para {acao}: Fixture não encontrada em {caminho}.")
+        return None
+    with open(caminho, encoding="utf-8") as arquivo:
+        return _envolver_valores(json.load(arquivo))
+
+class CacheFundamentus:
+    """Cache em SQLite dos snapshots do fundamentus, por ação e data do pregão.
+
+    Um snapshot do pregão atual mais novo que ``ttl`` é devolvido direto do disco.
+    Um snapshot do pregão atual já vencido também é devolvido, mas dispara uma
+    atualização em segundo plano (stale-while-revalidate). Sem snapshot, ou com um
+    snapshot de um pregão anterior, a busca é feita na hora; se ela falhar, o snapshot
+    anterior é devolvido como obsoleto. O número de ações guardadas é limitado por
+    ``max_entradas``, descartando as menos acessadas recentemente.
+    """
+
+    def __init__(self, caminho=None, ttl=TTL_FUNDAMENTUS, max_entradas=MAX_ENTRADAS_FUNDAMENTUS,
+                 buscar=None, diretorio_fixtures=FIXTURES_FUNDAMENTUS):
+        self.caminho = caminho or os.path.join(DIRETORIO_CACHE, "fundamentus.sqlite3")
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        if buscar is None:
+            if diretorio_fixtures:
+                buscar = lambda acao: carregar_fixture_fundamentus(diretorio_fixtures, acao)
+            else:
+                buscar = buscar_dados_fundamentus
+        self._buscar = buscar
+        self._trava = threading.Lock()
+        self._revalidando = set()
+        self._executor = None
+        self.acertos = 0
+        self.obsoletos = 0
+        self.perdas = 0
+
+        if os.path.dirname(self.caminho):
+            os.makedirs(os.path.dirname(self.caminho), exist_ok=True)
+        with self._conectar() as conexao:
+            conexao.execute(
+                "CREATE TABLE IF NOT EXISTS snapshots ("
+                " acao TEXT PRIMARY KEY, data_pregao TEXT NOT NULL,"
+                " criado_em REAL NOT NULL, acessado_em REAL NOT NULL, dados BLOB NOT NULL)"
+            )
+
+    def _conectar(self):
+        return sqlite3.connect(self.caminho, timeout=30)
+
+    def estatisticas(self):
+        return {"acertos": self.acertos, "obsoletos": self.obsoletos, "perdas": self.perdas}
+
+    def obter(self, acao):
+        agora = time.time()
+        with self._conectar() as conexao:
+            linha = conexao.execute(
+                "SELECT data_pregao, criado_em, dados FROM snapshots WHERE acao = ?", (acao,)
+            ).fetchone()
+            if linha is not None:
+                conexao.execute("UPDATE snapshots SET acessado_em = ? WHERE acao = ?", (agora, acao))
+
+        # Snapshot de outro pregão só é usado se a busca na hora falhar
+        if linha is None or linha[0] != data_pregao():
+            atualizados = self._atualizar(acao)
+            if atualizados is not None or linha is None:
+                with self._trava:
+                    self.perdas += 1
+                metricas.contar("cache_fundamentus.perdas")
+                return atualizados
+            with self._trava:
+                self.obsoletos += 1
+            metricas.contar("cache_fundamentus.obsoletos")
+            return pickle.loads(linha[2])
+
+        _, criado_em, dados = linha
+        with self._trava:
+            if agora - criado_em < self.ttl:
+                self.acertos += 1
+                metricas.contar("cache_fundamentus.acertos")
+            else:
+                self.obsoletos += 1
+                metricas.contar("cache_fundamentus.obsoletos")
+                self._agendar_revalidacao(acao)
+        return pickle.loads(dados)
+
+    def _atualizar(self, acao):
+        with metricas.medir("fundamentus", acao):
+            dados = self._buscar(acao)
+        if dados is not None:
+            self.gravar(acao, dados)
+        return dados
+
+    def gravar(self, acao, dados):
+        agora = time.time()
+        with self._conectar() as conexao:
+            conexao.execute(
+                "INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?, ?)",
+                (acao, data_pregao(), agora, agora, pickle.dumps(dados)),
+            )
+            conexao.execute(
+                "DELETE FROM snapshots WHERE acao NOT IN"
+                " (SELECT acao FROM snapshots ORDER BY acessado_em DESC LIMIT ?)",
+                (self.max_entradas,),
+            )
+
+    def _agendar_revalidacao(self, acao):
+        # Chamado com self._trava adquirida
+        if acao in self._revalidando:
+            return
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="revalidar-fundamentus")
+        self._revalidando.add(acao)
+        self._executor.submit(self._revalidar, acao)
+
+    def _revalidar(self, acao):
+        try:
+            self._atualizar(acao)
+        except Exception as e:
+            registrar_erro("revalidacao", acao, f"Erro ao revalidar dados para {acao}: {e}")
+        finally:
+            with self._trava:
+                self._revalidando.discard(acao)
+
+    def limpar(self):
+        with self._conectar() as conexao:
+            conexao.execute("DELETE FROM snapshots")
+
+# Função para buscar os dados da ação diretamente no fundamentus (sem cache)
+def buscar_dados_fundamentus(acao):
+    try:
+        import fundamentus  # Para obter os dados da B3
+        pipeline = fundamentus.Pipeline(acao)
+        response = pipeline.get_all_information()
+        # Verifica se a resposta contém os dados esperados
+        if not response or not hasattr(response, 'transformed_information'):
+            registrar_erro("fundamentus", acao, f"Erro ao obter dados para {acao}: Resposta da API incompleta.")
+            return None
+        return response.transformed_information
+    except HTTPError as e:
+        if e.code == 404:
+            registrar_erro("fundamentus", acao, f"Erro ao obter dados para {acao}: Ação não encontrada (404).")
+            return None
+        else:
+            registrar_erro("fundamentus", acao, f"Erro ao obter dados para {acao}: Erro HTTP {e.code}")
+            return None
+    except Exception as e:
+        registrar_erro("fundamentus", acao, f"Erro ao obter dados para {acao}: {e}")
+        return None
+
+# Caches e clientes únicos do processo, criados no primeiro uso: importar o módulo não abre
+# nenhum banco nem inicia o despachante. Quem precisar de outros (o app, o benchmark) atribui
+# a estas variáveis antes da análise.
+cache_fundamentus = None
+cache_respostas_ia = None
+despachante_ia = None
+historico_precos = None
+ultimas_analises = None
+armazem_resultados = None
+
+_trava_instancias = threading.RLock()
+
+def _instancia_unica(nome, criar):
+    with _trava_instancias:
+        if globals()[nome] is None:
+            globals()[nome] = criar()
+        return globals()[nome]
+
+def obter_cache_fundamentus():
+    return _instancia_unica("cache_fundamentus", CacheFundamentus)
+
+# Função para obter os dados da ação usando fundamentus (com cache em disco)
+def obter_dados_acao(acao):
+    return obter_cache_fundamentus().obter(acao)
+
+# Campos extraídos para a IA: (nome, rótulo no prompt, caminho em transformed_information)
+CAMPOS_IA = (
+    ("cotacao", "Cotação", ("price_information", "price")),
+    ("data_cotacao", "Data da Cotação", ("price_information", "date")),
+    ("tipo_acao", "Tipo de Ação", ("detailed_information", "stock_type")),
+    ("volume_negociado", "Volume Negociado por Dia", ("detailed_information", "traded_volume_per_day")),
+    ("vpa", "VPA", ("detailed_information", "equity_value_per_share")),
+    ("lpa", "LPA", ("detailed_information", "earnings_per_share")),
+    ("min_52_sem", "Mínimo 52 Semanas", ("detailed_information", "variation_52_weeks", "lowest_value")),
+    ("max_52_sem", "Máximo 52 Semanas", ("detailed_information", "variation_52_weeks", "highest_value")),
+    ("variacao_dia", "Variação Dia", ("oscillations", "variation_day")),
+    ("variacao_mes", "Variação Mês", ("oscillations", "variation_month")),
+    ("variacao_30_dias", "Variação 30 Dias", ("oscillations", "variation_30_days")),
+    ("variacao_12_meses", "Variação 12 Meses", ("oscillations", "variation_12_months")),
+    ("variacao_2022", "Variação 2022", ("oscillations", "variation_2022")),
+    ("variacao_2021", "Variação 2021", ("oscillations", "variation_2021")),
+    ("variacao_2020", "Variação 2020", ("oscillations", "variation_2020")),
+    ("variacao_2019", "Variação 2019", ("oscillations", "variation_2019")),
+    ("variacao_2018", "Variação 2018", ("oscillations", "variation_2018")),
+    ("variacao_2017", "Variação 2017", ("oscillations", "variation_2017")),
+    ("pl", "P/L", ("valuation_indicators", "price_divided_by_profit_title")),
+    ("pvp", "P/VP", ("valuation_indicators", "price_divided_by_asset_value")),
+    ("pebit", "P/EBIT", ("valuation_indicators", "price_divided_by_ebit")),
+    ("psr", "PSR", ("valuation_indicators", "price_divided_by_net_revenue")),
+    ("preco_ativos", "Preço/Ativos", ("valuation_indicators", "price_divided_by_total_assets")),
+    ("preco_ativ_circ_liq", "Preço/Ativ Circ Liq", ("valuation_indicators", "price_divided_by_net_current_assets")),
+    ("dividend_yield", "Dividend Yield", ("valuation_indicators", "dividend_yield")),
+    ("ev_ebitda", "EV/EBITDA", ("valuation_indicators", "enterprise_value_by_ebitda")),
+    ("ev_ebit", "EV/EBIT", ("valuation_indicators", "enterprise_value_by_ebit")),
+    ("preco_capital_giro", "Preço/Capital de Giro", ("valuation_indicators", "price_by_working_capital")),
+    ("roe", "ROE", ("profitability_indicators", "return_on_equity")),
+    ("roic", "ROIC", ("profitability_indicators", "return_on_invested_capital")),
+    ("ebit_ativo", "EBIT/Ativo", ("profitability_indicators", "ebit_divided_by_total_assets")),
+    ("crescimento_receita_5_anos", "Crescimento Receita 5 Anos", ("profitability_indicators", "net_revenue_growth_last_5_years")),
+    ("giro_ativos", "Giro Ativos", ("profitability_indicators", "net_revenue_divided_by_total_assets")),
+    ("margem_bruta", "Margem Bruta", ("profitability_indicators", "gross_profit_divided_by_net_revenue")),
+    ("margem_ebit", "Margem EBIT", ("profitability_indicators", "ebit_divided_by_net_revenue")),
+    ("margem_liquida", "Margem Líquida", ("profitability_indicators", "net_income_divided_by_net_revenue")),
+    ("liquidez_corrente", "Liquidez Corrente", ("indebtedness_indicators", "current_liquidity")),
+    ("divida_bruta_patrimonio", "Dívida Bruta/Patrimônio", ("indebtedness_indicators", "gross_debt_by_equity")),
+    ("divida_liquida_patrimonio", "Dívida Líquida/Patrimônio", ("indebtedness_indicators", "net_debt_by_equity")),
+    ("divida_liquida_ebitda", "Dívida Líquida/EBITDA", ("indebtedness_indicators", "net_debt_by_ebitda")),
+    ("patrimonio_ativos", "Patrimônio/Ativos", ("indebtedness_indicators", "equity_by_total_assets")),
+    ("total_ativos", "Total de Ativos", ("balance_sheet", "total_assets")),
+    ("ativo_circulante", "Ativo Circulante", ("balance_sheet", "current_assets")),
+    ("disponibilidades", "Disponibilidades", ("balance_sheet", "cash")),
+    ("divida_bruta", "Dívida Bruta", ("balance_sheet", "gross_debt")),
+    ("divida_liquida", "Dívida Líquida", ("balance_sheet", "net_debt")),
+    ("patrimonio_liquido", "Patrimônio Líquido", ("balance_sheet", "equity")),
+    ("receita_liquida_3meses", "Receita Líquida 3 Meses", ("income_statement_data", "three_months", "revenue")),
+    ("ebit_3meses", "EBIT 3 Meses", ("income_statement_data", "three_months", "ebit")),
+    ("lucro_liquido_3meses", "Lucro Líquido 3 Meses", ("income_statement_data", "three_months", "net_income")),
+    ("receita_liquida_12meses", "Receita Líquida 12 Meses", ("income_statement_data", "twelve_months", "revenue")),
+    ("ebit_12meses", "EBIT 12 Meses", ("income_statement_data", "twelve_months", "ebit")),
+    ("lucro_liquido_12meses", "Lucro Líquido 12 Meses", ("income_statement_data", "twelve_months", "net_income")),
+)
+
+def _compilar_acessor(caminho):
+    """Gera uma função que percorre ``caminho`` e devolve o ``.value`` da folha (ou None)."""
+    *intermediarios, folha = caminho
+
+    def acessar(dados):
+        for chave in intermediarios:
+            dados = dados.get(chave)
+            if not dados:
+                return None
+        valor = dados.get(folha)
+        return valor.value if valor else None
+    return acessar
+
+# Registro imutável (com __slots__) de uma ação, na ordem de CAMPOS_IA
+RegistroAcao = namedtuple("RegistroAcao", ("acao", *(nome for nome, _, _ in CAMPOS_IA)))
+_ACESSORES_IA = tuple(_compilar_acessor(caminho) for _, _, caminho in CAMPOS_IA)
+
+# Função para preparar os dados para o modelo de IA
+def preparar_dados_para_ia(dados, acao):
+    if dados is None:
+        return None
+
+    try:
+        with metricas.medir("preparar", acao):
+            return RegistroAcao(acao, *(acessar(dados) for acessar in _ACESSORES_IA))
+    except Exception as e:
+        registrar_erro("preparar", acao, f"Erro ao preparar dados para IA da ação {acao}: {e}")
+        return None
+
+# Junta os registros de várias ações em uma única tabela colunar, indexada pela ação
+def extrair_lote(registros):
+    return pd.DataFrame.from_records([r for r in registros if r is not None],
+                                     columns=RegistroAcao._fields).set_index("acao")
+
+# Versão do texto do prompt; incremente ao alterá-lo para invalidar as respostas guardadas
+VERSAO_PROMPT = 2
+TTL_RESPOSTAS_IA = int(os.environ.get("RICHBOT_TTL_RESPOSTAS_IA", 7 * 24 * 3600))
+MAX_RESPOSTAS_IA = int(os.environ.get("RICHBOT_MAX_RESPOSTAS_IA", 2000))
+
+def _normalizar_valor(valor):
+    if isinstance(valor, float):
+        return float(f"{valor:.6g}") if valor == valor else None  # NaN vira None
+    if isinstance(valor, (int, str, bool)) or valor is None:
+        return valor
+    return str(valor)
+
+# Impressão digital do pedido: modelo, versão do prompt e registro normalizado da ação
+def impressao_digital(registro, nome_modelo=NOME_MODELO, versao_prompt=VERSAO_PROMPT):
+    conteudo = {
+        "modelo": nome_modelo,
+        "versao_prompt": versao_prompt,
+        "registro": {campo: _normalizar_valor(valor) for campo, valor in registro._asdict().items()},
+    }
+    return hashlib.sha256(json.dumps(conteudo, sort_keys=True).encode("utf-8")).hexdigest()
+
+class CacheRespostasIA:
+    """Guarda em SQLite as análises do Gemini, indexadas pela impressão digital do pedido.
+
+    Se os dados de uma ação não mudaram desde a última execução, a análise guardada é
+    reaproveitada e a chamada ao modelo é evitada. Entradas mais velhas que ``ttl`` são
+    descartadas e o total é limitado a ``max_entradas`` (as menos acessadas saem primeiro).
+    """
+
+    def __init__(self, caminho=None, ttl=TTL_RESPOSTAS_IA, max_entradas=MAX_RESPOSTAS_IA):
+        self.caminho = caminho or os.path.join(DIRETORIO_CACHE, "respostas_ia.sqlite3")
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self._trava = threading.Lock()
+        self.acertos = 0
+        self.perdas = 0
+        if os.path.dirname(self.caminho):
+            os.makedirs(os.path.dirname(self.caminho), exist_ok=True)
+        with self._conectar() as conexao:
+            conexao.execute(
+                "CREATE TABLE IF NOT EXISTS analises ("
+                " chave TEXT PRIMARY KEY, acao TEXT, criado_em REAL NOT NULL,"
+                " acessado_em REAL NOT NULL, analise TEXT NOT NULL, veredito TEXT NOT NULL)"
+            )
+
+    def _conectar(self):
+        return sqlite3.connect(self.caminho, timeout=30)
+
+    def estatisticas(self):
+        return {"acertos": self.acertos, "perdas": self.perdas}
+
+    def obter(self, chave):
+        agora = time.time()
+        with self._conectar() as conexao:
+            linha = conexao.execute(
+                "SELECT analise, veredito FROM analises WHERE chave = ? AND criado_em > ?",
+                (chave, agora - self.ttl),
+            ).fetchone()
+            if linha is not None:
+                conexao.execute("UPDATE analises SET acessado_em = ? WHERE chave = ?", (agora, chave))
+        with self._trava:
+            if linha is None:
+                self.perdas += 1
+            else:
+                self.acertos += 1
+        metricas.contar("cache_respostas_ia.perdas" if linha is None else "cache_respostas_ia.acertos")
+        if linha is None:
+            return None
+        analise, veredito = linha
+        return analise, Veredito(**json.loads(veredito))
+
+    def gravar(self, chave, acao, analise, veredito):
+        agora = time.time()
+        with self._conectar() as conexao:
+            conexao.execute(
+                "INSERT OR REPLACE INTO analises VALUES (?, ?, ?, ?, ?, ?)",
+                (chave, acao, agora, agora, analise, json.dumps(veredito._asdict())),
+            )
+            conexao.execute("DELETE FROM analises WHERE criado_em <= ?", (agora - self.ttl,))
+            conexao.execute(
+                "DELETE FROM analises WHERE chave NOT IN"
+                " (SELECT chave FROM analises ORDER BY acessado_em DESC LIMIT ?)",
+                (self.max_entradas,),
+            )
+
+def obter_cache_respostas_ia():
+    return _instancia_unica("cache_respostas_ia", CacheRespostasIA)
+
+# Veredito estruturado de uma análise: classificação, confiança (0 a 1) e fatores principais
+CLASSIFICACOES = ("Positivo", "Negativo", "Neutro")
+Veredito = namedtuple("Veredito", ("classificacao", "confianca", "fatores"))
+MAX_FATORES = 5
+
+# Instrução para o modelo terminar a análise com o veredito em JSON
+INSTRUCAO_VEREDITO = (
+    'Ao final, inclua um bloco JSON com o veredito, no formato '
+    '{"classificacao": "Positivo" | "Negativo" | "Neutro", "confianca": número entre 0 e 1, '
+    '"fatores": ["até 5 fatores principais"]}'
+)
+
+_PADRAO_BLOCO_VEREDITO = re.compile(r'(?:```(?:json)?\s*)?(\{[^{}]*"classificacao"[^{}]*\})\s*(?:```)?', re.S)
+# Um único padrão para o fallback: rótulo explícito ("classificação: positivo"), sinal solto,
+# negação ("não recomendo compra") ou fronteira de oração, que encerra o alcance da negação
+_PADRAO_SINAIS = re.compile(
+    r"(?:classifica[çc][ãa]o|recomenda[çc][ãa]o)(?:\s+final)?\s*[:\-]\s*\**\s*(?P<rotulo>positivo|negativo|neutro)"
+    r"|(?P<fronteira>[.,;:!?\n]|\b(?:mas|por[ée]m|contudo|entretanto|todavia)\b)"
+    r"|(?P<negacao>\b(?:n[ãa]o|nem|nenhuma?|sem)\b)"
+    r"|\b(?P<sinal>compra|positiv[oa]|venda|negativ[oa])\b"
+)
+_PESO_SINAIS = {"compra": 1, "positivo": 1, "positiva": 1, "venda": -1, "negativo": -1, "negativa": -1}
+
+# Valida um veredito vindo do JSON do modelo; devolve None se a classificação for inválida
+def validar_veredito(bruto):
+    if not isinstance(bruto, dict):
+        return None
+    classificacao = str(bruto.get("classificacao", "")).strip().capitalize()
+    if classificacao not in CLASSIFICACOES:
+        return None
+    try:
+        confianca = float(bruto.get("confianca"))
+        if 1 < confianca <= 100:
+            confianca /= 100  # Confiança informada em porcentagem
+        confianca = min(1.0, max(0.0, confianca))
+    except (TypeError, ValueError):
+        confianca = None
+    fatores = bruto.get("fatores") or []
+    if isinstance(fatores, str):
+        fatores = [fatores]
+    return Veredito(classificacao, confianca, [str(fator) for fator in fatores if fator][:MAX_FATORES])
+
+# Classificação de reserva, em uma única passada pelo texto, quando não há JSON válido
+def classificar_analise(analise):
+    """Soma os sinais de compra e venda; um sinal negado na mesma oração não conta.
+
+    >>> classificar_analise("Não recomendo compra.").classificacao
+    'Neutro'
+    >>> classificar_analise("A ação não é uma boa compra, mas também não é venda").classificacao
+    'Neutro'
+    >>> classificar_analise("Não há sinal de venda; recomendação de compra").classificacao
+    'Positivo'
+    >>> classificar_analise("Nem compra nem venda. Tendência negativa no curto prazo").classificacao
+    'Negativo'
+    >>> classificar_analise("Sem sinais de compra").classificacao
+    'Neutro'
+    >>> classificar_analise("Classificação final: **Neutro**, apesar do viés de compra").classificacao
+    'Neutro'
+    """
+    pontos = 0
+    negada = False
+    for sinal in _PADRAO_SINAIS.finditer(analise.lower()):
+        if sinal["rotulo"]:
+            return Veredito(sinal["rotulo"].capitalize(), None, [])
+        if sinal["fronteira"]:
+            negada = False
+        elif sinal["negacao"]:
+            negada = True
+        elif not negada:
+            pontos += _PESO_SINAIS[sinal["sinal"]]
+    classificacao = "Positivo" if pontos > 0 else "Negativo" if pontos < 0 else "Neutro"
+    return Veredito(classificacao, None, [])
+
+# Separa o texto da análise do bloco JSON com o veredito
+def extrair_veredito(texto):
+    blocos = list(_PADRAO_BLOCO_VEREDITO.finditer(texto))
+    if blocos:
+        bloco = blocos[-1]
+        try:
+            veredito = validar_veredito(json.loads(bloco.group(1)))
+        except ValueError:
+            veredito = None
+        if veredito is not None:
+            return (texto[:bloco.start()] + texto[bloco.end():]).strip(), veredito
+    return texto, classificar_analise(texto)
+
+# Instruções comuns aos prompts individuais e em lote
+INSTRUCOES_ANALISE = """baseada no histórico, indicando se o ativo representa uma oportunidade de compra
+        por preço baixo e venda em no mínimo 1 dia útil e no máximo 5 dias úteis.
+        Forneça indicativos para o usuário com previsão de análise do que pode ocorrer
+        com base em todos os dados extraídos e fornecidos para cada ação.
+        Nunca sugira operações de day trade. Dê peso maior para ROIC e P/L.
+        Classifique a recomendação como "Positivo", "Negativo" ou "Neutro". "Com base nos siguientes dados da ação, analise se há uma oportunidade de investimento de curto prazo. Considere a tendência recente, liquidez, múltiplos de valuation, endividamento e rentabilidade. Identifique sinais de valorização ou risco elevado e forneça uma conclusão objetiva sobre o potencial de curto prazo.
+        Com base nesses indicadores, avalie:
+
+        Se há tendência de valorização ou queda no curto prazo.
+
+        Se o volume negociado sugere alta liquidez ou risco de baixa demanda.
+
+        Se os múltiplos indicam uma ação subvalorizada ou sobrevalorizada.
+
+        Se o histórico recente e os fundamentos financeiros justificam um investimento de curto prazo.
+
+        Forneça uma recomendação clara, destacando os fatores positivos e os riscos envolvidos.\""""
+
+# Monta o texto do prompt de uma ação
+def montar_prompt(data):
+    dados_formatados = "\n        ".join(
+        f"{rotulo}: {valor}" for (_, rotulo, _), valor in zip(CAMPOS_IA, data[1:])
+    )
+    prompt_text = f"""
+        Analise os dados da ação {data.acao} e forneça uma análise qualitativa completa,
+        {INSTRUCOES_ANALISE}
+        
+        Dados da Ação:
+        {dados_formatados}
+
+        {INSTRUCAO_VEREDITO}
+    """
+    return prompt_text
+
+# Configuração do modo em lote (várias ações por requisição ao Gemini)
+MODO_LOTE_IA = os.environ.get("RICHBOT_LOTE_IA", "0") == "1"
+MAX_ACOES_POR_LOTE = int(os.environ.get("RICHBOT_MAX_ACOES_LOTE", 10))
+ORCAMENTO_TOKENS_LOTE = int(os.environ.get("RICHBOT_ORCAMENTO_TOKENS_LOTE", 8000))  # Entrada + saída estimadas
+TOKENS_RESPOSTA_POR_ACAO = 500  # Estimativa do tamanho da análise de cada ação
+
+# Estimativa grosseira de tokens (~4 caracteres por token)
+def estimar_tokens(texto):
+    return len(texto) // 4 + 1
+
+def _linha_lote(registro):
+    return ";".join("" if valor is None else str(valor) for valor in registro)
+
+# Monta um único prompt com as instruções uma só vez e uma linha compacta por ação
+def montar_prompt_lote(registros):
+    cabecalho = ";".join(["Ação", *(rotulo for _, rotulo, _ in CAMPOS_IA)])
+    linhas = "\n".join(_linha_lote(registro) for registro in registros)
+    acoes_lote = ", ".join(registro.acao for registro in registros)
+    return f"""
+        Analise os dados de cada uma das ações da tabela abaixo e forneça, para cada uma, uma análise qualitativa completa,
+        {INSTRUCOES_ANALISE}
+
+        Responda somente com um objeto JSON, sem texto adicional, no formato
+        {{"ACAO": {{"classificacao": "Positivo" | "Negativo" | "Neutro", "confianca": número entre 0 e 1,
+        "fatores": ["até 5 fatores principais"], "analise": "texto da análise"}}}}
+        com uma chave para cada uma destas ações: {acoes_lote}.
+
+        Dados das Ações (separados por ";"; campos vazios não estão disponíveis):
+{cabecalho}
+{linhas}
+    """
+
+# Divide os registros em lotes que cabem no orçamento de tokens de uma requisição
+def dividir_em_lotes(registros, orcamento_tokens=ORCAMENTO_TOKENS_LOTE, max_por_lote=MAX_ACOES_POR_LOTE):
+    base = estimar_tokens(montar_prompt_lote([]))
+    lotes, atual, tokens = [], [], base
+    for registro in registros:
+        custo = estimar_tokens(_linha_lote(registro)) + len(registro.acao) + TOKENS_RESPOSTA_POR_ACAO
+        if atual and (tokens + custo > orcamento_tokens or len(atual) >= max_por_lote):
+            lotes.append(atual)
+            atual, tokens = [], base
+        atual.append(registro)
+        tokens += custo
+    if atual:
+        lotes.append(atual)
+    return lotes
+
+# Interpreta a resposta JSON do lote, devolvendo {acao: (analise, veredito)}
+def interpretar_resposta_lote(texto, acoes_lote):
+    inicio, fim = texto.find("{"), texto.rfind("}")
+    if inicio < 0 or fim < inicio:
+        raise ValueError("a resposta do lote não contém JSON")
+    respostas = json.loads(texto[inicio:fim + 1])
+    resultado = {}
+    for acao in acoes_lote:
+        item = respostas.get(acao)
+        if not isinstance(item, dict) or not item.get("analise"):
+            resultado[acao] = (None, f"Erro: a resposta do lote não trouxe a ação {acao}.")
+            continue
+        analise = str(item["analise"])
+        resultado[acao] = (analise, validar_veredito(item) or classificar_analise(analise))
+    return resultado
+
+# Configuração do despacho das chamadas ao Gemini
+REQUISICOES_POR_MINUTO_IA = float(os.environ.get("RICHBOT_RPM_IA", 15))  # Cota de requisições por minuto
+RAJADA_IA = int(os.environ.get("RICHBOT_RAJADA_IA", 1))  # Requisições que podem sair de uma vez
+MAX_SIMULTANEAS_IA = int(os.environ.get("RICHBOT_MAX_SIMULTANEAS_IA", 4))  # Requisições em andamento
+TIMEOUT_IA = float(os.environ.get("RICHBOT_TIMEOUT_IA", 60))  # Segundos por requisição
+MAX_TENTATIVAS_IA = int(os.environ.get("RICHBOT_TENTATIVAS_IA", 5))
+ESPERA_BASE_IA = 1.0  # Segundos da primeira espera entre tentativas (dobra a cada nova tentativa)
+ESPERA_MAXIMA_IA = 30.0
+CODIGOS_TRANSITORIOS = {429, 500, 502, 503, 504}
+
+class BaldeDeFichas:
+    """Limitador de taxa (token bucket) para corrotinas de um mesmo event loop."""
+
+    def __init__(self, taxa_por_segundo, capacidade=1):
+        self.taxa = taxa_por_segundo
+        self.capacidade = max(1, capacidade)
+        self._fichas = float(self.capacidade)
+        self._ultimo = None
+        self._trava = asyncio.Lock()
+
+    async def adquirir(self):
+        async with self._trava:
+            while True:
+                agora = asyncio.get_running_loop().time()
+                if self._ultimo is not None:
+                    self._fichas = min(self.capacidade, self._fichas + (agora - self._ultimo) * self.taxa)
+                self._ultimo = agora
+                if self._fichas >= 1:
+                    self._fichas -= 1
+                    return
+                await asyncio.sleep((1 - self._fichas) / self.taxa)
+
+# Indica se vale a pena repetir a chamada (cota excedida, erro 5xx ou tempo esgotado)
+def erro_transitorio(erro):
+    if isinstance(erro, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return True
+    codigo = getattr(erro, "code", None) or getattr(erro, "status_code", None)
+    if callable(codigo):
+        codigo = None  # Erros do gRPC expõem code() em vez de um número HTTP
+    return codigo in CODIGOS_TRANSITORIOS
+
+class DespachanteIA:
+    """Despacha as chamadas ao Gemini em um event loop próprio, rodando em segundo plano.
+
+    Cada chamada espera uma ficha do ``BaldeDeFichas`` (mantendo o ritmo em
+    ``requisicoes_por_minuto``), respeita o limite de requisições em andamento e tem
+    ``timeout`` segundos para responder. Erros 429/5xx e tempos esgotados são repetidos
+    com espera exponencial e jitter, até ``max_tentativas``. ``submeter`` pode ser
+    chamado de qualquer thread e devolve um ``concurrent.futures.Future``.
+    """
+
+    def __init__(self, requisicoes_por_minuto=REQUISICOES_POR_MINUTO_IA, rajada=RAJADA_IA,
+                 max_simultaneas=MAX_SIMULTANEAS_IA, timeout=TIMEOUT_IA, max_tentativas=MAX_TENTATIVAS_IA,
+                 espera_base=ESPERA_BASE_IA, espera_maxima=ESPERA_MAXIMA_IA):
+        self.requisicoes_por_minuto = requisicoes_por_minuto
+        self.rajada = rajada
+        self.max_simultaneas = max_simultaneas
+        self.timeout = timeout
+        self.max_tentativas = max(1, max_tentativas)
+        self.espera_base = espera_base
+        self.espera_maxima = espera_maxima
+        self._loop = None
+        self._trava = threading.Lock()
+        self.tentativas_repetidas = 0
+
+    def _iniciar_loop(self):
+        with self._trava:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="despachante-ia", daemon=True).start()
+                self._balde = BaldeDeFichas(self.requisicoes_por_minuto / 60, self.rajada)
+                self._semaforo = asyncio.Semaphore(max(1, self.max_simultaneas))
+                self._loop = loop
+        return self._loop
+
+    def submeter(self, registro, modelo=None, cache=None):
+        """Agenda a análise de um registro e devolve um Future com (analise, veredito)."""
+        return asyncio.run_coroutine_threadsafe(self.analisar(registro, modelo, cache), self._iniciar_loop())
+
+    async def _chamar_modelo(self, modelo, prompt_text):
+        if hasattr(modelo, "generate_content_async"):
+            return await modelo.generate_content_async(prompt_text)
+        return await asyncio.to_thread(modelo.generate_content, prompt_text)
+
+    async def gerar(self, modelo, prompt_text, acao=None):
+        """Chama o modelo respeitando a cota, o limite de simultaneidade e as repetições.
+
+        ``acao`` identifica a ação nas métricas (None nas requisições em lote).
+        """
+        async with self._semaforo:
+            for tentativa in range(self.max_tentativas):
+                inicio_espera = time.perf_counter()
+                await self._balde.adquirir()
+                metricas.registrar("ia_espera_cota", time.perf_counter() - inicio_espera, acao)
+                try:
+                    with metricas.medir("ia", acao):
+                        return await asyncio.wait_for(self._chamar_modelo(modelo, prompt_text), self.timeout)
+                except Exception as e:
+                    if tentativa == self.max_tentativas - 1 or not erro_transitorio(e):
+                        raise
+                    self.tentativas_repetidas += 1
+                    metricas.contar("ia.tentativas_repetidas")
+                    espera = min(self.espera_maxima, self.espera_base * 2 ** tentativa)
+                    await asyncio.sleep(random.uniform(0, espera))  # Jitter completo
+
+    async def _resolver_modelo(self, modelo):
+        # O informado, o global ``model`` ou o cliente padrão (montado fora do loop, pois importa o SDK)
+        if modelo is None:
+            modelo = model
+        if modelo is None:
+            try:
+                modelo = await asyncio.to_thread(obter_modelo)
+            except Exception as e:
+                registrar_erro("ia", None, f"Erro ao inicializar o modelo do Gemini: {e}")
+        return modelo
+
+    async def analisar(self, data, modelo=None, cache=None):
+        modelo = await self._resolver_modelo(modelo)
+        cache = obter_cache_respostas_ia() if cache is None else cache
+        if modelo is None:
+            return None, "Erro: Modelo de IA não inicializado."  # Retorna None e mensagem de erro
+
+        nome_modelo = getattr(modelo, "model_name", NOME_MODELO)
+        chave = impressao_digital(data, nome_modelo) if cache else None
+        if chave is not None:
+            guardada = await asyncio.to_thread(cache.obter, chave)
+            if guardada is not None:
+                return guardada
+
+        try:
+            with metricas.medir("prompt", data.acao):
+                prompt_text = montar_prompt(data)
+            response = await self.gerar(modelo, prompt_text, data.acao)
+            analise, veredito = extrair_veredito(response.text)
+            if chave is not None:
+                await asyncio.to_thread(cache.gravar, chave, data.acao, analise, veredito)
+            return analise, veredito
+        except Exception as e:
+            e = str(e) or type(e).__name__  # TimeoutError não tem mensagem
+            registrar_erro("ia", data.acao, f"Erro ao enviar prompt para o Gemini: {e}")
+            return None, f"Erro ao obter análise da IA: {e}"
+
+    async def analisar_lote(self, registros, modelo=None, cache=None):
+        """Analisa vários registros em uma única requisição; devolve {acao: (analise, veredito)}."""
+        modelo = await self._resolver_modelo(modelo)
+        cache = obter_cache_respostas_ia() if cache is None else cache
+        if modelo is None:
+            return {registro.acao: (None, "Erro: Modelo de IA não inicializado.") for registro in registros}
+
+        nome_modelo = getattr(modelo, "model_name", NOME_MODELO)
+        resultados, faltantes, chaves = {}, [], {}
+        for registro in registros:
+            if cache:
+                chave = impressao_digital(registro, nome_modelo, f"lote-{VERSAO_PROMPT}")
+                guardada = await asyncio.to_thread(cache.obter, chave)
+                if guardada is not None:
+                    resultados[registro.acao] = guardada
+                    continue
+                chaves[registro.acao] = chave
+            faltantes.append(registro)
+        if not faltantes:
+            return resultados
+
+        acoes_lote = [registro.acao for registro in faltantes]
+        try:
+            response = await self.gerar(modelo, montar_prompt_lote(faltantes))
+            respostas = interpretar_resposta_lote(response.text, acoes_lote)
+        except Exception as e:
+            e = str(e) or type(e).__name__
+            registrar_erro("ia_lote", None, f"Erro ao enviar prompt em lote para o Gemini: {e}")
+            respostas = {acao: (None, f"Erro ao obter análise da IA: {e}") for acao in acoes_lote}
+
+        for acao, (analise, veredito) in respostas.items():
+            if analise is not None and acao in chaves:
+                await asyncio.to_thread(cache.gravar, chaves[acao], acao, analise, veredito)
+        resultados.update(respostas)
+        return resultados
+
+    def submeter_lote(self, registros, modelo=None, cache=None):
+        """Agenda a análise de um lote e devolve um Future com {acao: (analise, veredito)}."""
+        return asyncio.run_coroutine_threadsafe(self.analisar_lote(registros, modelo, cache), self._iniciar_loop())
+
+def obter_despachante_ia():
+    return _instancia_unica("despachante_ia", DespachanteIA)
+
+class ColetorLoteIA:
+    """Junta os registros que saem da etapa de dados e os despacha em lotes.
+
+    Um lote é enviado assim que não cabe mais no orçamento de tokens, ou quando todas
+    as ``total`` ações esperadas já chegaram (ou falharam antes da IA). Cada ação recebe
+    seu próprio Future com (analise, veredito), como em ``DespachanteIA.submeter``.
+    """
+
+    def __init__(self, total, despachante=None, orcamento_tokens=ORCAMENTO_TOKENS_LOTE,
+                 max_por_lote=MAX_ACOES_POR_LOTE):
+        self._despachante = despachante or obter_despachante_ia()
+        self._restantes = total
+        self._orcamento_tokens = orcamento_tokens
+        self._max_por_lote = max_por_lote
+        self._pendentes = []
+        self._futuros = {}
+        self._trava = threading.Lock()
+
+    def adicionar(self, registro):
+        futuro = Future()
+        with self._trava:
+            self._futuros[registro.acao] = futuro
+            self._pendentes.append(registro)
+            self._restantes -= 1
+            lotes = self._retirar_lotes()
+        self._enviar(lotes)
+        return futuro
+
+    def descartar(self):
+        """Registra uma ação que não chegará à IA (falhou na etapa de dados)."""
+        with self._trava:
+            self._restantes -= 1
+            lotes = self._retirar_lotes()
+        self._enviar(lotes)
+
+    def _retirar_lotes(self):
+        # Chamado com self._trava adquirida: retira os lotes completos (ou todos, no final)
+        lotes = dividir_em_lotes(self._pendentes, self._orcamento_tokens, self._max_por_lote)
+        if self._restantes > 0 and lotes:
+            self._pendentes = lotes.pop()  # O último lote ainda pode receber ações
+        else:
+            self._pendentes = []
+        return lotes
+
+    def _enviar(self, lotes):
+        for lote in lotes:
+            futuros = {registro.acao: self._futuros.pop(registro.acao) for registro in lote}
+            self._despachante.submeter_lote(lote).add_done_callback(
+                lambda f, futuros=futuros: self._distribuir(f, futuros))
+
+    @staticmethod
+    def _distribuir(futuro_lote, futuros):
+        try:
+            respostas = futuro_lote.result()
+        except Exception as e:
+            respostas = {acao: (None, f"Erro ao obter análise da IA: {e}") for acao in futuros}
+        for acao, futuro in futuros.items():
+            futuro.set_result(respostas.get(acao, (None, f"Erro: a resposta do lote não trouxe a ação {acao}.")))
+
+# Função para enviar a análise para o Gemini
+def enviar_analise_para_ia(data, modelo=None, cache=None):
+    """Envia o registro da ação ao modelo, reaproveitando a resposta se os dados não mudaram.
+
+    ``modelo`` substitui o modelo global (qualquer objeto com ``generate_content``) e
+    ``cache`` substitui o cache global de respostas; ``cache=False`` desativa o cache.
+    A chamada passa pelo ``despachante_ia`` e bloqueia até a resposta.
+    """
+    return obter_despachante_ia().submeter(data, modelo, cache).result()
+
+# Limites de concorrência por etapa do pipeline (as chamadas ao Gemini são limitadas pelo despachante_ia)
+LIMITES_ETAPAS = {
+    "dados": 8,     # Raspagem do fundamentus
+    "historico": 1, # Download em lote do histórico no yfinance
+    "grafico": 6,   # Indicadores técnicos e dados do gráfico
+}
+
+TTL_HISTORICO = int(os.environ.get("RICHBOT_TTL_HISTORICO", 3600))  # Segundos até reconsultar o Yahoo por novas barras
+TOLERANCIA_AJUSTE = 1e-4  # Variação relativa da barra de ancoragem que indica preços reajustados (proventos, desdobramentos)
+DIAS_HISTORICO = 365
+CAMPOS_OHLCV = ["Open", "High", "Low", "Close", "Volume"]
+
+def _baixar_yfinance(acoes, inicio):
+    """Baixa o OHLCV de várias ações em uma única requisição ao Yahoo."""
+    import yfinance as yf # Para obter dados históricos do ativo
+    tickers = [f"{acao}.SA" for acao in acoes]
+    frame = yf.download(tickers, start=inicio, auto_adjust=True, group_by="column",
+                        progress=False, threads=True)
+    if frame is None or frame.empty:
+        return pd.DataFrame(columns=["acao", "data", *CAMPOS_OHLCV])
+    if not isinstance(frame.columns, pd.MultiIndex):
+        frame.columns = pd.MultiIndex.from_product([frame.columns, tickers])
+    longo = frame[CAMPOS_OHLCV].stack(level=1, future_stack=True).dropna(subset=["Close"])
+    longo.index.names = ["data", "ticker"]
+    longo = longo.reset_index()
+    longo["acao"] = longo["ticker"].str.removesuffix(".SA")
+    longo["data"] = pd.to_datetime(longo["data"]).dt.strftime("%Y-%m-%d")
+    return longo[["acao", "data", *CAMPOS_OHLCV]]
+
+class HistoricoPrecos:
+    """Armazena em SQLite o histórico diário (OHLCV) das ações e o atualiza de forma incremental.
+
+    ``carregar`` consulta o Yahoo uma única vez para toda a seleção, pedindo apenas as
+    barras a partir da penúltima data já guardada (a última barra é rebaixada, pois pode
+    ter sido gravada com o pregão ainda aberto). A penúltima barra, já fechada, serve de
+    ancoragem: se o fechamento dela mudou, o Yahoo reajustou a série (proventos ou
+    desdobramentos) e a janela inteira da ação é baixada de novo, para que as barras
+    guardadas não misturem bases de ajuste. Ações consultadas há menos de ``ttl``
+    segundos não geram requisição. O resultado é um único DataFrame largo com colunas
+    (campo, ação), que ``historico_da_acao`` fatia por ação.
+    """
+
+    def __init__(self, caminho=None, ttl=TTL_HISTORICO, dias=DIAS_HISTORICO, baixar=_baixar_yfinance):
+        self.caminho = caminho or os.path.join(DIRETORIO_CACHE, "historico.sqlite3")
+        self.ttl = ttl
+        self.dias = dias
+        self._baixar = baixar
+        self._trava = threading.Lock()
+        if os.path.dirname(self.caminho):
+            os.makedirs(os.path.dirname(self.caminho), exist_ok=True)
+        with self._conectar() as conexao:
+            conexao.execute(
+                "CREATE TABLE IF NOT EXISTS barras (acao TEXT NOT NULL, data TEXT NOT NULL,"
+                " Open REAL, High REAL, Low REAL, Close REAL, Volume REAL, PRIMARY KEY (acao, data))"
+            )
+            conexao.execute(
+                "CREATE TABLE IF NOT EXISTS controle (acao TEXT PRIMARY KEY, atualizado_em REAL NOT NULL)"
+            )
+
+    def _conectar(self):
+        return sqlite3.connect(self.caminho, timeout=30)
+
+    def _inicio_janela(self):
+        return (datetime.now(ZoneInfo("America/Sao_Paulo")).date() - timedelta(days=self.dias)).isoformat()
+
+    def atualizar(self, acoes):
+        """Baixa, em uma única requisição, as barras que faltam para as ações informadas."""
+        agora = time.time()
+        placeholders = ",".join("?" * len(acoes))
+        with self._trava, self._conectar() as conexao:
+            ancoras = {}
+            for acao, data, fechamento in conexao.execute(
+                "SELECT acao, data, Close FROM (SELECT acao, data, Close, ROW_NUMBER() OVER"
+                f" (PARTITION BY acao ORDER BY data DESC) AS n FROM barras WHERE acao IN ({placeholders}))"
+                " WHERE n <= 2 ORDER BY n", acoes,
+            ):
+                ancoras[acao] = (data, fechamento)  # Fica a penúltima barra, quando houver
+            recentes = {acao for (acao,) in conexao.execute(
+                f"SELECT acao FROM controle WHERE acao IN ({placeholders}) AND atualizado_em > ?",
+                (*acoes, agora - self.ttl),
+            )}
+            pendentes = [acao for acao in acoes if acao not in recentes]
+            if not pendentes:
+                return
+            # Uma só requisição começando pela barra de ancoragem mais antiga da seleção
+            inicio = min(ancoras[acao][0] if acao in ancoras else self._inicio_janela() for acao in pendentes)
+            barras = self._baixar(pendentes, inicio)
+            reajustadas = self._reajustadas(barras, ancoras)
+            if reajustadas:
+                conexao.execute(
+                    f"DELETE FROM barras WHERE acao IN ({','.join('?' * len(reajustadas))})", reajustadas
+                )
+                barras = pd.concat([barras[~barras["acao"].isin(reajustadas)],
+                                    self._baixar(reajustadas, self._inicio_janela())])
+            conexao.executemany(
+                "INSERT OR REPLACE INTO barras VALUES (?, ?, ?, ?, ?, ?, ?)",
+                barras[["acao", "data", *CAMPOS_OHLCV]].itertuples(index=False, name=None),
+            )
+            conexao.executemany(
+                "INSERT OR REPLACE INTO controle VALUES (?, ?)", [(acao, agora) for acao in pendentes]
+            )
+            conexao.execute("DELETE FROM barras WHERE data < ?", (self._inicio_janela(),))
+
+    @staticmethod
+    def _reajustadas(barras, ancoras):
+        """Ações cuja barra de ancoragem voltou do Yahoo com outro fechamento."""
+        if not ancoras or barras.empty:
+            return []
+        guardadas = pd.DataFrame([(acao, data, fechamento) for acao, (data, fechamento) in ancoras.items()],
+                                 columns=["acao", "data", "guardado"])
+        comparacao = barras[["acao", "data", "Close"]].merge(guardadas, on=["acao", "data"])
+        mudou = ~np.isclose(comparacao["Close"], comparacao["guardado"], rtol=TOLERANCIA_AJUSTE, atol=0)
+        return sorted(comparacao.loc[mudou, "acao"].unique())
+
+    def carregar(self, acoes, atualizar=True):
+        """Retorna o OHLCV de 1 ano das ações em um DataFrame largo (datas x (campo, ação)).
+
+        Com ``atualizar=False`` só as barras já guardadas em disco são lidas, sem acessar o Yahoo.
+        """
+        acoes = list(dict.fromkeys(acoes))
+        if not acoes:
+            return pd.DataFrame()
+        try:
+            if atualizar:
+                self.atualizar(acoes)
+        except Exception as e:
+            registrar_erro("historico", None, f"Erro ao atualizar o histórico de preços: {e}")  # Usa o que houver no disco
+        placeholders = ",".join("?" * len(acoes))
+        with self._conectar() as conexao:
+            longo = pd.read_sql_query(
+                f"SELECT * FROM barras WHERE acao IN ({placeholders}) AND data >= ? ORDER BY data",
+                conexao, params=(*acoes, self._inicio_janela()),
+            )
+        longo["data"] = pd.to_datetime(longo["data"])
+        return longo.pivot(index="data", columns="acao", values=CAMPOS_OHLCV)
+
+# Fatia o DataFrame largo do histórico para uma única ação
+def historico_da_acao(frame, acao):
+    if frame is None or frame.empty or acao not in frame.columns.get_level_values(1):
+        return None
+    hist = frame.xs(acao, axis=1, level=1).dropna(subset=["Close"])
+    return hist if not hist.empty else None
+
+def obter_historico_precos():
+    return _instancia_unica("historico_precos", HistoricoPrecos)
+
+# Carrega o histórico da seleção e calcula os indicadores de todas as ações juntas
+def carregar_historico_e_indicadores(acoes, atualizar=True):
+    with metricas.medir("historico"):
+        frame = obter_historico_precos().carregar(acoes, atualizar)
+    if frame.empty:
+        return frame, {}
+    with metricas.medir("indicadores"):
+        return frame, calcular_indicadores(frame["Close"], frame["Volume"])
+
+def _vetor_grafico(serie):
+    return np.ascontiguousarray(serie.to_numpy(dtype=np.float32, na_value=np.nan))
+
+# Função para obter os dados do gráfico (histórico e indicadores técnicos)
+def obter_dados_grafico(acao, hist=None, indicadores=None):
+    try:
+        if hist is None:
+            hist = historico_da_acao(obter_historico_precos().carregar([acao]), acao) # Pega o histórico de 1 ano
+        if hist is None:
+            registrar_erro("grafico", acao, f"Erro ao obter dados para gráfico de {acao}: Histórico indisponível.")
+            return None
+        # Séries como vetores float32 contíguos que compartilham o mesmo índice de datas
+        price_series = _vetor_grafico(hist['Close'])
+        volume_series = _vetor_grafico(hist['Volume'])
+
+        # Indicadores já calculados em lote ou, na falta deles, calculados só para esta ação
+        if indicadores is None:
+            indicadores = calcular_indicadores(hist[['Close']].rename(columns={'Close': acao}),
+                                               hist[['Volume']].rename(columns={'Volume': acao}))
+        serie = indicadores_da_acao(indicadores, acao, hist.index)
+
+        ma_values = {f'MA{janela}': _vetor_grafico(serie[f'MA{janela}']) for janela in JANELAS_MEDIAS if f'MA{janela}' in serie}
+        rsi_value = serie['RSI'].iloc[-1] if 'RSI' in serie else None  # Obtém o último valor de RSI
+        if rsi_value is not None and pd.isna(rsi_value):
+            rsi_value = None
+        volume_ma = _vetor_grafico(serie[f'VolMA{JANELA_VOLUME}']) if f'VolMA{JANELA_VOLUME}' in serie else None
+
+        return {
+            'dates': hist.index.values,
+            'price_series': price_series,
+            'volume_series': volume_series,
+            'ma_values': ma_values,
+            'volume_ma': volume_ma,
+            'rsi': rsi_value
+        }
+    except Exception as e:
+        registrar_erro("grafico", acao, f"Erro ao obter dados para gráfico de {acao}: {e}")
+        return None
+
+# Configuração da triagem quantitativa que antecede a IA
+TOP_K_IA = int(os.environ.get("RICHBOT_TOP_K_IA", 0))  # Só as K melhores pontuadas vão para a IA (0 = todas)
+PESOS_TRIAGEM = {  # ROIC e P/L pesam mais, como pede o prompt
+    "roic": 2.0,
+    "pl": 2.0,
+    "divida_ebitda": 1.0,
+    "liquidez": 1.0,
+    "rsi": 1.0,
+    "medias": 1.0,
+}
+STATUS_FORA_DA_TRIAGEM = "Fora da triagem"
+
+# Último valor de cada indicador (e do fechamento) por ação, a partir do histórico em lote
+def snapshot_indicadores(frame, indicadores):
+    if frame is None or frame.empty:
+        return pd.DataFrame()
+    ultimos = {nome: tabela.ffill().iloc[-1] for nome, tabela in indicadores.items()}
+    ultimos["Close"] = frame["Close"].ffill().iloc[-1]
+    return pd.DataFrame(ultimos)
+
+def pontuar_acoes(fundamentos, tecnicos=None, pesos=PESOS_TRIAGEM):
+    """Pontua todas as ações de uma vez, de 0 (pior) a 1 (melhor).
+
+    ``fundamentos`` tem uma linha por ação (colunas de ``RegistroAcao``, índice ``acao``)
+    e ``tecnicos`` o último valor dos indicadores (``snapshot_indicadores``). Os múltiplos
+    viram percentis entre as ações; o RSI vale mais quanto mais longe da sobrecompra e as
+    médias valem pelos cruzamentos de alta. Critérios sem dado valem 0,5. Retorna um
+    DataFrame com um critério por coluna e a ``pontuacao``, da melhor para a pior.
+    """
+    tecnicos = pd.DataFrame() if tecnicos is None else tecnicos
+    curta, media, longa = (f"MA{janela}" for janela in JANELAS_MEDIAS)
+    tecnicos = tecnicos.reindex(index=fundamentos.index, columns=["RSI", curta, media, longa])
+    numero = lambda campo: pd.to_numeric(fundamentos[campo], errors="coerce")
+    pl = numero("pl")
+    medias = tecnicos[[curta, media, longa]]
+    criterios = pd.DataFrame({
+        "roic": numero("roic").rank(pct=True),
+        "pl": pl.where(pl > 0).rank(pct=True, ascending=False).mask(pl <= 0, 0.0),  # Prejuízo é o pior caso
+        "divida_ebitda": numero("divida_liquida_ebitda").rank(pct=True, ascending=False),
+        "liquidez": numero("volume_negociado").rank(pct=True),
+        "rsi": ((70 - tecnicos["RSI"]) / 40).clip(0, 1),  # 1 abaixo de 30, 0 acima de 70
+        "medias": (((medias[curta] > medias[media]).astype(float) + (medias[media] > medias[longa]))
+                   / 2).where(medias.notna().all(axis=1)),
+    }, index=fundamentos.index)
+    pesos = pd.Series(pesos).reindex(criterios.columns, fill_value=0.0)
+    criterios["pontuacao"] = (criterios.fillna(0.5) * pesos).sum(axis=1) / pesos.sum()
+    return criterios.sort_values("pontuacao", ascending=False, kind="stable")
+
+class TriagemQuantitativa:
+    """Ordena as ações pela ``pontuar_acoes`` e libera para a IA só as ``top_k`` melhores.
+
+    Como no ``ColetorLoteIA``, cada ação chega por ``adicionar`` (ou ``descartar``, se
+    falhou antes). Quando as ``total`` ações esperadas chegaram e o histórico em lote
+    ficou pronto, todas são pontuadas de uma vez e o Future de cada uma recebe
+    ``{"pontuacao", "posicao", "selecionada"}``.
+    """
+
+    def __init__(self, total, top_k, futuro_historico=None):
+        self.top_k = top_k
+        self._restantes = total
+        self._futuro_historico = futuro_historico
+        self._registros = []
+        self._futuros = {}
+        self._pontuada = False
+        self._trava = threading.Lock()
+        if futuro_historico is not None:
+            futuro_historico.add_done_callback(lambda _: self._verificar())
+
+    def adicionar(self, registro):
+        futuro = Future()
+        with self._trava:
+            self._futuros[registro.acao] = futuro
+            self._registros.append(registro)
+            self._restantes -= 1
+        self._verificar()
+        return futuro
+
+    def descartar(self):
+        """Registra uma ação que não chegará à triagem (falhou na etapa de dados)."""
+        with self._trava:
+            self._restantes -= 1
+        self._verificar()
+
+    def _verificar(self):
+        with self._trava:
+            historico_pronto = self._futuro_historico is None or self._futuro_historico.done()
+            if self._pontuada or self._restantes > 0 or not historico_pronto:
+                return
+            self._pontuada = True
+        if self._futuros:
+            self._pontuar()
+
+    def _pontuar(self):
+        tecnicos = None
+        if self._futuro_historico is not None and self._futuro_historico.exception() is None:
+            tecnicos = snapshot_indicadores(*self._futuro_historico.result())
+        fundamentos = extrair_lote(self._registros)
+        try:
+            with metricas.medir("triagem"):
+                ranking = pontuar_acoes(fundamentos, tecnicos)
+        except Exception as e:
+            # Sem pontuação, nenhuma ação é barrada
+            registrar_erro("triagem", None, f"Erro na triagem quantitativa: {e}")
+            ranking = pd.DataFrame({"pontuacao": np.nan}, index=fundamentos.index)
+        for posicao, (acao, pontuacao) in enumerate(ranking["pontuacao"].items(), start=1):
+            self._futuros[acao].set_result({
+                "pontuacao": None if pd.isna(pontuacao) else round(float(pontuacao), 4),
+                "posicao": posicao,
+                "selecionada": pd.isna(pontuacao) or posicao <= self.top_k,
+            })
+
+# Indica se a ação foi barrada pela triagem quantitativa (e por isso não tem análise da IA)
+def fora_da_triagem(resultado):
+    return not resultado.get("triagem", {}).get("selecionada", True)
+
+# Configuração da detecção de mudanças entre execuções
+DETECTAR_MUDANCAS = os.environ.get("RICHBOT_DETECTAR_MUDANCAS", "1") == "1"
+LIMITES_MUDANCA = {
+    "preco": float(os.environ.get("RICHBOT_LIMITE_PRECO", 0.03)),          # Variação relativa da cotação
+    "multiplos": float(os.environ.get("RICHBOT_LIMITE_MULTIPLOS", 0.05)),  # Variação relativa dos múltiplos
+    "rsi": float(os.environ.get("RICHBOT_LIMITE_RSI", 5.0)),               # Pontos de RSI
+}
+CAMPOS_MUDANCA = ("pl", "pvp", "ev_ebitda", "roe", "roic", "divida_liquida_ebitda", "dividend_yield")
+IDADE_MAXIMA_ANALISE = int(os.environ.get("RICHBOT_IDADE_MAXIMA_ANALISE", 7 * 24 * 3600))  # Segundos
+STATUS_SEM_MUDANCAS = "Sem mudanças"
+_ROTULOS_IA = {nome: rotulo for nome, rotulo, _ in CAMPOS_IA}
+
+class UltimasAnalises:
+    """Guarda em SQLite a última análise completa de cada ação e os dados que a originaram.
+
+    Cada entrada tem o registro do fundamentus, o último valor dos indicadores e o
+    resultado (sem as figuras). Ela é a referência da detecção de mudanças e só é
+    trocada quando a ação é analisada de novo, de modo que pequenas variações que se
+    acumulam entre execuções acabam passando dos limites.
+    """
+
+    def __init__(self, caminho=None):
+        self.caminho = caminho or os.path.join(DIRETORIO_CACHE, "ultimas_analises.sqlite3")
+        if os.path.dirname(self.caminho):
+            os.makedirs(os.path.dirname(self.caminho), exist_ok=True)
+        with self._conectar() as conexao:
+            conexao.execute(
+                "CREATE TABLE IF NOT EXISTS ultimas ("
+                " acao TEXT PRIMARY KEY, analisada_em REAL NOT NULL, conteudo BLOB NOT NULL)"
+            )
+
+    def _conectar(self):
+        return sqlite3.connect(self.caminho, timeout=30)
+
+    def obter(self, acao):
+        """Retorna {"analisada_em", "registro", "tecnicos", "resultado"} ou None."""
+        with self._conectar() as conexao:
+            linha = conexao.execute(
+                "SELECT analisada_em, conteudo FROM ultimas WHERE acao = ?", (acao,)
+            ).fetchone()
+        if linha is None:
+            return None
+        return {"analisada_em": linha[0], **pickle.loads(linha[1])}
+
+    def gravar(self, acao, registro, tecnicos, resultado):
+        resultado = {chave: valor for chave, valor in resultado.items()
+                     if chave not in ("figuras", "reaproveitada", "mudancas")}
+        conteudo = {"registro": registro._asdict(), "tecnicos": dict(tecnicos), "resultado": resultado}
+        with self._conectar() as conexao:
+            conexao.execute("INSERT OR REPLACE INTO ultimas VALUES (?, ?, ?)",
+                            (acao, time.time(), pickle.dumps(conteudo)))
+
+    def limpar(self):
+        with self._conectar() as conexao:
+            conexao.execute("DELETE FROM ultimas")
+
+def obter_ultimas_analises():
+    return _instancia_unica("ultimas_analises", UltimasAnalises)
+
+def _numero(valor):
+    try:
+        numero = float(valor)
+    except (TypeError, ValueError):
+        return None
+    return None if np.isnan(numero) else numero
+
+# Indica se um valor variou além do limite relativo (aparecer ou sumir também conta)
+def _variou(antes, depois, limite):
+    antes, depois = _numero(antes), _numero(depois)
+    if antes is None or depois is None:
+        return (antes is None) != (depois is None)
+    if antes == 0:
+        return depois != 0
+    return abs(depois - antes) / abs(antes) > limite
+
+def _zona_rsi(rsi):
+    return None if rsi is None else (rsi < 30) - (rsi > 70)  # 1 sobrevenda, -1 sobrecompra
+
+def _cruzamentos(tecnicos):
+    curta, media, longa = (_numero(tecnicos.get(f"MA{janela}")) for janela in JANELAS_MEDIAS)
+    if None in (curta, media, longa):
+        return None
+    return (curta > media, media > longa)
+
+def detectar_mudancas(anterior, registro, tecnicos=None, limites=LIMITES_MUDANCA, agora=None):
+    """Motivos para reanalisar a ação desde a ``anterior`` (``UltimasAnalises.obter``).
+
+    Conta a variação da cotação e dos ``CAMPOS_MUDANCA`` além dos ``limites``, o RSI
+    (em pontos ou ao entrar/sair das zonas de 30 e 70) e a troca dos cruzamentos das
+    médias. Uma lista vazia significa que a análise anterior ainda vale. Com
+    ``tecnicos=None`` só o registro do fundamentus é comparado, o que dispensa esperar
+    pelo histórico.
+    """
+    if anterior is None:
+        return ["sem análise anterior"]
+    agora = time.time() if agora is None else agora
+    if agora - anterior["analisada_em"] > IDADE_MAXIMA_ANALISE:
+        return ["análise anterior expirada"]
+
+    antes, depois = anterior["registro"], registro._asdict()
+    tecnicos_antes = anterior["tecnicos"]
+    motivos = []
+    # O fechamento do histórico é mais atual que a cotação do fundamentus, quando há os dois
+    if tecnicos and "Close" in tecnicos_antes and "Close" in tecnicos:
+        preco_antes, preco = tecnicos_antes["Close"], tecnicos["Close"]
+    else:
+        preco_antes, preco = antes.get("cotacao"), depois.get("cotacao")
+    if _variou(preco_antes, preco, limites["preco"]):
+        motivos.append(f"Cotação: {preco_antes} → {preco}")
+    for campo in CAMPOS_MUDANCA:
+        if _variou(antes.get(campo), depois.get(campo), limites["multiplos"]):
+            motivos.append(f"{_ROTULOS_IA[campo]}: {antes.get(campo)} → {depois.get(campo)}")
+    if tecnicos is None:
+        return motivos
+
+    rsi_antes, rsi = _numero(tecnicos_antes.get("RSI")), _numero(tecnicos.get("RSI"))
+    if (rsi_antes is None) != (rsi is None) or (
+            rsi is not None and (abs(rsi - rsi_antes) > limites["rsi"] or _zona_rsi(rsi) != _zona_rsi(rsi_antes))):
+        motivos.append(f"RSI: {rsi_antes if rsi_antes is None else round(rsi_antes, 1)} → "
+                       f"{rsi if rsi is None else round(rsi, 1)}")
+    if _cruzamentos(tecnicos_antes) != _cruzamentos(tecnicos):
+        motivos.append("Cruzamento das médias móveis")
+    return motivos
+
+# Resultado anterior de uma ação que não mudou, marcado com a data da análise original
+def reaproveitar_resultado(anterior):
+    return {**anterior["resultado"], "reaproveitada": {"analisada_em": anterior["analisada_em"]}}
+
+# Etapa de dados: busca no fundamentus e prepara o registro para a IA
+def etapa_dados(acao):
+    dados_acao = obter_dados_acao(acao)
+    if dados_acao is None:
+        raise ValueError(f"Não foi possível obter dados para a ação {acao}.")
+
+    dados_para_ia = preparar_dados_para_ia(dados_acao, acao)
+    if dados_para_ia is None:
+        raise ValueError(f"Não foi possível preparar os dados para a ação {acao} para análise da IA.")
+    return dados_para_ia
+
+# Valida a resposta da etapa de IA
+def _resposta_ia(acao, resposta):
+    analise_ia, veredito = resposta # Recebe a análise e o veredito
+    if analise_ia is None:
+        raise ValueError(f"Erro ao obter análise da IA para a ação {acao}.")
+    return analise_ia, veredito
+
+# Etapa de IA: envia o registro ao Gemini
+def etapa_ia(acao, dados_para_ia):
+    return _resposta_ia(acao, enviar_analise_para_ia(dados_para_ia))
+
+def montar_resultado(dados_para_ia, analise_ia, veredito, chart_data, triagem=None):
+    # Converter o dicionário em um DataFrame para exibição
+    df_dados = pd.DataFrame([dados_para_ia], columns=RegistroAcao._fields)
+    veredito = veredito or Veredito(None, None, [])  # Ações fora da triagem não têm veredito
+    resultado = {"analise": analise_ia, "classificacao": veredito.classificacao, "confianca": veredito.confianca,
+                 "fatores": veredito.fatores, "dados": df_dados, "chart_data": chart_data} # Armazena o veredito, os dados e os dados do gráfico
+    if triagem is not None:
+        resultado["triagem"] = triagem
+    return resultado
+
+def analisar_acao(acao, resultados, acao_status):
+    """Executa o pipeline completo de uma ação de forma sequencial."""
+    try:
+        dados_para_ia = etapa_dados(acao)
+        analise_ia, veredito = etapa_ia(acao, dados_para_ia)
+    except ValueError as e:
+        resultados[acao] = {"erro": str(e)}
+        acao_status[acao] = "Erro"
+        return
+
+    chart_data = obter_dados_grafico(acao)
+    resultados[acao] = montar_resultado(dados_para_ia, analise_ia, veredito, chart_data)
+    acao_status[acao] = "Concluído" #Atualiza o status da ação
+
+class AgendadorAnalise:
+    """Executa o pipeline das ações em etapas, cada uma com seu próprio pool limitado.
+
+    A busca no fundamentus, o download do histórico e o cálculo dos indicadores rodam
+    em executores separados e as chamadas ao Gemini vão para o ``despachante_ia``, de
+    modo que uma etapa lenta não ocupa as vagas das outras. O histórico de toda a
+    seleção é baixado em lote por ``preparar_historico``, que também calcula os
+    indicadores de todas as ações de uma vez, e o gráfico de cada ação é montado em
+    paralelo com a busca de dados e a análise da IA. Com ``usar_deteccao_mudancas``, o
+    gráfico e a IA só rodam para as ações que mudaram desde a última análise; com
+    triagem, a comparação vale só para as ações selecionadas, depois que a seleção
+    inteira (inclusive as que não mudaram) foi pontuada.
+    """
+
+    def __init__(self, limites=None):
+        limites = {**LIMITES_ETAPAS, **(limites or {})}
+        self._executores = {
+            etapa: ThreadPoolExecutor(max_workers=max(1, n), thread_name_prefix=f"analise-{etapa}")
+            for etapa, n in limites.items()
+        }
+        self._futuro_historico = None
+        self._coletor_ia = None
+        self._triagem = None
+        self._ultimas = None
+        self._snapshot = None
+        self._trava_snapshot = threading.Lock()
+
+    def submeter(self, etapa, fn, *args):
+        return self._executores[etapa].submit(fn, *args)
+
+    def usar_lote_ia(self, total):
+        """Passa a enviar ao Gemini lotes de ações em vez de uma requisição por ação."""
+        self._coletor_ia = ColetorLoteIA(total)
+
+    def usar_triagem(self, total, top_k):
+        """Passa a enviar à IA só as ``top_k`` ações mais bem pontuadas entre as ``total``."""
+        self._triagem = TriagemQuantitativa(total, top_k, self._futuro_historico)
+
+    def usar_deteccao_mudancas(self, ultimas=None):
+        """Reaproveita a última análise das ações cujos dados não passaram de ``LIMITES_MUDANCA``."""
+        self._ultimas = ultimas or obter_ultimas_analises()
+
+    def _tecnicos_da_acao(self, acao):
+        # Último valor dos indicadores da ação, a partir do histórico em lote (calculado uma vez)
+        if self._futuro_historico is None or self._futuro_historico.exception() is not None:
+            return {}
+        with self._trava_snapshot:
+            if self._snapshot is None:
+                self._snapshot = snapshot_indicadores(*self._futuro_historico.result())
+        if acao not in self._snapshot.index:
+            return {}
+        return self._snapshot.loc[acao].dropna().to_dict()
+
+    def preparar_historico(self, acoes):
+        """Agenda o download em lote do histórico de todas as ações da seleção."""
+        self._futuro_historico = self.submeter("historico", carregar_historico_e_indicadores, list(acoes))
+        return self._futuro_historico
+
+    def _etapa_grafico(self, acao):
+        hist, indicadores = None, None
+        if self._futuro_historico is not None:
+            try:
+                frame, indicadores = self._futuro_historico.result()
+                hist = historico_da_acao(frame, acao)
+            except Exception as e:
+                registrar_erro("historico", acao, f"Erro ao baixar o histórico em lote: {e}")
+        if hist is None:
+            indicadores = None
+        with metricas.medir("grafico", acao):
+            return obter_dados_grafico(acao, hist, indicadores)
+
+    def analisar(self, acao):
+        """Agenda o pipeline de uma ação e retorna um Future com o resultado (ou o erro) dela."""
+        concluido = Future()
+        inicio = time.perf_counter()
+
+        futuro_grafico = Future()
+        futuro_analise = Future()
+        trava = threading.Lock()
+        finalizado = []
+        motivos_mudanca = []  # Por que a ação voltou à IA, com a detecção de mudanças ligada
+
+        def finalizar(_):
+            # Chamado quando a análise e o gráfico terminam (em qualquer ordem)
+            with trava:
+                if finalizado or not (futuro_analise.done() and futuro_grafico.done()):
+                    return
+                finalizado.append(True)
+            try:
+                dados_para_ia, analise_ia, veredito, triagem = futuro_analise.result()
+                chart_data = futuro_grafico.result()
+                resultado = montar_resultado(dados_para_ia, analise_ia, veredito, chart_data, triagem)
+            except Exception as e:
+                resultado = {"erro": str(e)}
+            if motivos_mudanca and "erro" not in resultado and not fora_da_triagem(resultado):
+                try:
+                    # O gráfico já esperou pelo histórico em lote, então os indicadores estão prontos
+                    self._ultimas.gravar(acao, dados_para_ia, self._tecnicos_da_acao(acao), resultado)
+                except Exception as e:
+                    registrar_erro("mudancas", acao, f"Erro ao guardar a análise de {acao}: {e}")
+                resultado["mudancas"] = motivos_mudanca
+            concluir(resultado)
+
+        def concluir(resultado):
+            metricas.registrar("total", time.perf_counter() - inicio, acao, "erro" not in resultado)
+            concluido.set_result(resultado)
+
+        def agendar_grafico():
+            def copiar(futuro):
+                try:
+                    futuro_grafico.set_result(futuro.result())
+                except Exception as e:
+                    futuro_grafico.set_exception(e)
+            self.submeter("grafico", self._etapa_grafico, acao).add_done_callback(copiar)
+
+        def descartar_lote_ia():
+            # A ação não chegará à IA
+            if self._coletor_ia is not None:
+                self._coletor_ia.descartar()
+
+        def apos_ia(futuro_ia, dados_para_ia, triagem):
+            try:
+                futuro_analise.set_result((dados_para_ia, *_resposta_ia(acao, futuro_ia.result()), triagem))
+            except Exception as e:
+                futuro_analise.set_exception(e)
+
+        def enviar_para_ia(dados_para_ia, triagem=None):
+            if self._coletor_ia is not None:
+                futuro_ia = self._coletor_ia.adicionar(dados_para_ia)
+            else:
+                futuro_ia = obter_despachante_ia().submeter(dados_para_ia)
+            futuro_ia.add_done_callback(lambda f: apos_ia(f, dados_para_ia, triagem))
+
+        def verificar_mudancas(dados_para_ia, triagem, com_tecnicos=False):
+            try:
+                anterior = self._ultimas.obter(acao)
+                tecnicos = self._tecnicos_da_acao(acao) if com_tecnicos else None
+                with metricas.medir("mudancas", acao):
+                    motivos = detectar_mudancas(anterior, dados_para_ia, tecnicos)
+            except Exception as e:
+                registrar_erro("mudancas", acao, f"Erro ao comparar {acao} com a análise anterior: {e}")
+                motivos = ["falha na comparação"]
+            if motivos:
+                metricas.contar("mudancas.reanalisadas")
+                motivos_mudanca.extend(motivos)
+                agendar_grafico()
+                enviar_para_ia(dados_para_ia, triagem)
+            elif not com_tecnicos:
+                # O fundamentus não mudou: quem decide são os indicadores, que dependem do histórico em lote.
+                # As ações que mudaram no fundamentus seguem para a IA sem esperar por ele
+                if self._futuro_historico is None:
+                    verificar_mudancas(dados_para_ia, triagem, com_tecnicos=True)
+                else:
+                    self._futuro_historico.add_done_callback(
+                        lambda _: verificar_mudancas(dados_para_ia, triagem, com_tecnicos=True))
+            else:
+                # Nada relevante mudou: sem IA e sem gráfico novo
+                metricas.contar("mudancas.reaproveitadas")
+                descartar_lote_ia()
+                resultado = reaproveitar_resultado(anterior)
+                if triagem is not None:
+                    resultado["triagem"] = triagem  # Posição na triagem desta execução
+                concluir(resultado)
+
+        def apos_triagem(dados_para_ia, triagem):
+            if triagem is not None and not triagem["selecionada"]:
+                descartar_lote_ia()
+                if self._ultimas is not None:
+                    futuro_grafico.set_result(None)  # Fora da triagem, o gráfico não é montado
+                futuro_analise.set_result((dados_para_ia, None, None, triagem))
+            elif self._ultimas is None:
+                enviar_para_ia(dados_para_ia, triagem)
+            else:
+                verificar_mudancas(dados_para_ia, triagem)
+
+        def apos_dados(futuro_dados):
+            try:
+                dados_para_ia = futuro_dados.result()
+            except Exception as e:
+                # A ação não chegará à triagem nem à IA
+                descartar_lote_ia()
+                if self._triagem is not None:
+                    self._triagem.descartar()
+                futuro_analise.set_exception(e)
+                if self._ultimas is not None:
+                    futuro_grafico.set_result(None)  # O gráfico ainda não foi agendado
+                return
+            if self._triagem is not None:
+                # A triagem pontua a seleção inteira; a detecção de mudanças vem depois, só para as escolhidas
+                self._triagem.adicionar(dados_para_ia).add_done_callback(
+                    lambda f: apos_triagem(dados_para_ia, f.result()))
+            else:
+                apos_triagem(dados_para_ia, None)
+
+        futuro_analise.add_done_callback(finalizar)
+        futuro_grafico.add_done_callback(finalizar)
+        if self._ultimas is None:
+            agendar_grafico()  # Sem detecção de mudanças, o gráfico é montado em paralelo com os dados
+        self.submeter("dados", etapa_dados, acao).add_done_callback(apos_dados)
+        return concluido
+
+    def encerrar(self):
+        for executor in self._executores.values():
+            executor.shutdown(wait=True)
+
+ARMAZEM_EM_DISCO = os.environ.get("RICHBOT_ARMAZEM_SQLITE", "0") == "1"
+
+class ArmazemResultados:
+    """Resultados das análises compartilhados por todas as sessões do processo.
+
+    Os resultados valem para o pregão em que foram gerados. ``reservar`` devolve um
+    Future para cada ação: pronto, se já há resultado do pregão; o mesmo Future de
+    quem já está analisando a ação, se houver (coalescência); ou um Future novo, que
+    quem reservou deve completar com ``concluir``. Com ``caminho``, os resultados
+    bem-sucedidos também são gravados em SQLite e sobrevivem a reinícios do app.
+    """
+
+    def __init__(self, caminho=None):
+        self.caminho = caminho
+        self._trava = threading.Lock()
+        self._resultados = {}
+        self._em_andamento = {}
+        self._arquivos_importados = {}
+        if self.caminho:
+            if os.path.dirname(self.caminho):
+                os.makedirs(os.path.dirname(self.caminho), exist_ok=True)
+            with self._conectar() as conexao:
+                conexao.execute(
+                    "CREATE TABLE IF NOT EXISTS resultados ("
+                    " acao TEXT NOT NULL, dia TEXT NOT NULL, resultado BLOB NOT NULL, PRIMARY KEY (acao, dia))"
+                )
+
+    def _conectar(self):
+        return sqlite3.connect(self.caminho, timeout=30)
+
+    def _expirar(self, dia):
+        # Chamado com self._trava adquirida: descarta os resultados de pregões anteriores
+        for chave in [chave for chave in self._resultados if chave[1] != dia]:
+            del self._resultados[chave]
+        if self.caminho:
+            with self._conectar() as conexao:
+                conexao.execute("DELETE FROM resultados WHERE dia <> ?", (dia,))
+
+    def _carregar_do_disco(self, acao, dia):
+        if not self.caminho:
+            return None
+        with self._conectar() as conexao:
+            linha = conexao.execute(
+                "SELECT resultado FROM resultados WHERE acao = ? AND dia = ?", (acao, dia)
+            ).fetchone()
+        return pickle.loads(linha[0]) if linha else None
+
+    def reservar(self, acoes, dia=None):
+        """Retorna ({acao: Future}, [ações que quem chamou deve analisar e concluir])."""
+        dia = dia or data_pregao()
+        futuros, reservadas = {}, []
+        with self._trava:
+            self._expirar(dia)
+            for acao in acoes:
+                chave = (acao, dia)
+                if chave not in self._resultados:
+                    guardado = self._carregar_do_disco(acao, dia)
+                    if guardado is not None:
+                        self._resultados[chave] = guardado
+                if chave in self._resultados:
+                    futuro = Future()
+                    futuro.set_result(self._resultados[chave])
+                elif chave in self._em_andamento:
+                    futuro = self._em_andamento[chave]
+                else:
+                    futuro = self._em_andamento[chave] = Future()
+                    reservadas.append(acao)
+                futuros[acao] = futuro
+        return futuros, reservadas
+
+    def concluir(self, acao, resultado, dia=None):
+        """Publica o resultado de uma ação reservada e libera quem estava esperando por ela."""
+        dia = dia or data_pregao()
+        with self._trava:
+            futuro = self._em_andamento.pop((acao, dia), None)
+            # Erros e ações fora da triagem não ficam guardados, para que a ação possa ser refeita
+            if "erro" not in resultado and not fora_da_triagem(resultado):
+                self._resultados[(acao, dia)] = resultado
+                if self.caminho:
+                    with self._conectar() as conexao:
+                        conexao.execute("INSERT OR REPLACE INTO resultados VALUES (?, ?, ?)",
+                                        (acao, dia, pickle.dumps(resultado)))
+        if futuro is not None:
+            futuro.set_result(resultado)
+
+    def esquecer(self, acoes, dia=None):
+        """Descarta os resultados guardados das ações, para que sejam analisadas de novo."""
+        dia = dia or data_pregao()
+        with self._trava:
+            for acao in acoes:
+                self._resultados.pop((acao, dia), None)
+            if self.caminho:
+                with self._conectar() as conexao:
+                    conexao.executemany("DELETE FROM resultados WHERE acao = ? AND dia = ?",
+                                        [(acao, dia) for acao in acoes])
+
+    def importar(self, resultados, dia):
+        """Publica resultados já prontos (por exemplo, do screener) para o pregão ``dia``."""
+        if dia != data_pregao():
+            return 0
+        with self._trava:
+            importados = {acao: resultado for acao, resultado in resultados.items()
+                          if "erro" not in resultado and not fora_da_triagem(resultado)}
+            for acao, resultado in importados.items():
+                self._resultados[(acao, dia)] = resultado
+        return len(importados)
+
+    def importar_arquivo(self, caminho):
+        """Importa a saída do screener em ``caminho`` se ela mudou desde a última leitura.
+
+        O arquivo é lido de novo quando muda a data de modificação, o tamanho ou o pregão
+        de referência (que, antes da abertura, ainda é o pregão anterior).
+        """
+        try:
+            estado = os.stat(caminho)
+        except OSError:
+            return 0
+        versao = (estado.st_mtime_ns, estado.st_size, data_pregao())
+        with self._trava:
+            if self._arquivos_importados.get(caminho) == versao:
+                return 0
+            self._arquivos_importados[caminho] = versao
+        dia, resultados = carregar_resultados_salvos(caminho, somente_dia=versao[2])
+        return self.importar(resultados, dia)
+
+    def limpar(self):
+        with self._trava:
+            self._resultados.clear()
+            if self.caminho:
+                with self._conectar() as conexao:
+                    conexao.execute("DELETE FROM resultados")
+
+# Arquivo gerado pelo screener (screener.py); a interface reaproveita os resultados do pregão atual
+SAIDA_SCREENER = os.environ.get("RICHBOT_SAIDA_SCREENER", os.path.join(DIRETORIO_CACHE, "screener.jsonl"))
+COLUNAS_SCREENER = ["acao", "data_pregao", "status", "erro", "classificacao", "confianca", "fatores", "analise", "rsi",
+                    "pontuacao", "posicao_triagem", "analisada_em"]
+
+STATUS_FINAIS = ("Concluído", "Erro", STATUS_FORA_DA_TRIAGEM, STATUS_SEM_MUDANCAS)
+
+# Status final de uma ação a partir do seu resultado
+def status_do_resultado(resultado):
+    if "erro" in resultado:
+        return "Erro"
+    if fora_da_triagem(resultado):
+        return STATUS_FORA_DA_TRIAGEM
+    return STATUS_SEM_MUDANCAS if "reaproveitada" in resultado else "Concluído"
+
+# Converte os resultados em uma tabela plana (uma linha por ação), sem os dados dos gráficos
+def resultados_para_tabela(resultados, dia=None):
+    dia = dia or data_pregao()
+    linhas = []
+    for acao, resultado in resultados.items():
+        triagem = resultado.get("triagem") or {}
+        linha = {"acao": acao, "data_pregao": dia, "status": status_do_resultado(resultado),
+                 "erro": resultado.get("erro"), "classificacao": resultado.get("classificacao"),
+                 "confianca": resultado.get("confianca"), "fatores": list(resultado.get("fatores") or []),
+                 "analise": resultado.get("analise"),
+                 "rsi": (resultado.get("chart_data") or {}).get("rsi"),
+                 "pontuacao": triagem.get("pontuacao"), "posicao_triagem": triagem.get("posicao"),
+                 "analisada_em": (resultado.get("reaproveitada") or {}).get("analisada_em")}
+        if resultado.get("dados") is not None:
+            registro = resultado["dados"].iloc[0].to_dict()
+            registro.pop("acao", None)
+            linha.update(registro)
+        linhas.append(linha)
+    colunas = COLUNAS_SCREENER + [campo for campo in RegistroAcao._fields if campo != "acao"]
+    return pd.DataFrame(linhas, columns=colunas)
+
+# Grava os resultados em Parquet ou JSONL, conforme a extensão do arquivo
+def salvar_resultados(resultados, caminho, dia=None):
+    tabela = resultados_para_tabela(resultados, dia)
+    if os.path.dirname(caminho):
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+    if caminho.endswith(".parquet"):
+        # Colunas com tipos misturados (texto e números do fundamentus) vão como texto
+        for coluna in tabela.columns.difference(["fatores"]):
+            if tabela[coluna].dtype == object:
+                tabela[coluna] = tabela[coluna].map(lambda valor: None if valor is None else str(valor))
+        tabela.to_parquet(caminho, index=False)
+    else:
+        tabela.to_json(caminho, orient="records", lines=True, force_ascii=False, date_format="iso")
+    return tabela
+
+# Lê um arquivo do screener e remonta os resultados (com os gráficos, a partir do histórico em cache)
+def carregar_resultados_salvos(caminho, somente_dia=None):
+    if caminho.endswith(".parquet"):
+        tabela = pd.read_parquet(caminho)
+    else:
+        tabela = pd.read_json(caminho, orient="records", lines=True, dtype=False)
+    if tabela.empty:
+        return None, {}
+    dia = str(tabela["data_pregao"].iloc[0])
+    if somente_dia is not None and dia != somente_dia:
+        return dia, {}
+    resultados = {}
+    for linha in tabela.to_dict("records"):
+        acao = linha["acao"]
+        if linha["status"] == "Erro":
+            resultados[acao] = {"erro": linha["erro"]}
+            continue
+        registro = RegistroAcao(**{campo: linha.get(campo) for campo in RegistroAcao._fields})
+        confianca = linha.get("confianca")
+        fatores = linha.get("fatores")  # Lista no JSONL, array do numpy no Parquet
+        triagem = None
+        if pd.notna(linha.get("posicao_triagem")):
+            pontuacao = linha.get("pontuacao")
+            triagem = {"pontuacao": None if pd.isna(pontuacao) else float(pontuacao),
+                       "posicao": int(linha["posicao_triagem"]),
+                       "selecionada": linha["status"] != STATUS_FORA_DA_TRIAGEM}
+        resultados[acao] = montar_resultado(
+            registro, linha["analise"],
+            Veredito(linha["classificacao"] if pd.notna(linha["classificacao"]) else None,
+                     None if pd.isna(confianca) else confianca, [] if fatores is None else list(fatores)),
+            None, triagem,
+        )
+        if linha["status"] == STATUS_SEM_MUDANCAS and pd.notna(linha.get("analisada_em")):
+            resultados[acao]["reaproveitada"] = {"analisada_em": float(linha["analisada_em"])}
+    concluidas = [acao for acao, resultado in resultados.items() if "erro" not in resultado]
+    try:
+        # Só o histórico que o screener deixou em disco: a interface não consulta o Yahoo aqui
+        frame, indicadores = carregar_historico_e_indicadores(concluidas, atualizar=False)
+        for acao in concluidas:
+            hist = historico_da_acao(frame, acao)
+            if hist is not None:
+                resultados[acao]["chart_data"] = obter_dados_grafico(acao, hist, indicadores)
+    except Exception as e:
+        registrar_erro("screener", None, f"Erro ao remontar os gráficos do screener: {e}")
+    return dia, resultados
+
+# Armazém do processo (comum a todas as sessões do app), em disco com RICHBOT_ARMAZEM_SQLITE=1
+def criar_armazem_resultados():
+    caminho = os.path.join(DIRETORIO_CACHE, "resultados.sqlite3") if ARMAZEM_EM_DISCO else None
+    return ArmazemResultados(caminho)
+
+# Devolve o armazém do processo, importando de novo a saída do screener sempre que ela mudar
+def obter_armazem_resultados():
+    armazem = _instancia_unica("armazem_resultados", criar_armazem_resultados)
+    if SAIDA_SCREENER:
+        try:
+            armazem.importar_arquivo(SAIDA_SCREENER)
+        except Exception as e:
+            registrar_erro("screener", None, f"Erro ao carregar os resultados do screener: {e}")
+    return armazem
+
+def _registrar_resultado(acao, resultado, resultados, acao_status):
+    resultados[acao] = resultado
+    acao_status[acao] = status_do_resultado(resultado) #Atualiza o status da ação
+
+def iniciar_analise(acoes_selecionadas, resultados, acao_status, analise_concluida, limites=None,
+                    lote_ia=MODO_LOTE_IA, armazem=None, top_k=TOP_K_IA, detectar_mudancas=DETECTAR_MUDANCAS,
+                    atualizar=False):
+    armazem = armazem or obter_armazem_resultados()
+    dia = data_pregao()
+    if atualizar:
+        armazem.esquecer(acoes_selecionadas, dia)  # Refaz o pregão atual (só o que mudou vai à IA)
+    futuros, reservadas = armazem.reservar(acoes_selecionadas, dia)
+    agendador = AgendadorAnalise(limites)
+    try:
+        # Só as ações sem resultado do pregão e que ninguém está analisando passam pelo pipeline
+        if reservadas:
+            if lote_ia:
+                agendador.usar_lote_ia(len(reservadas))
+            agendador.preparar_historico(reservadas)
+            if top_k and top_k < len(reservadas):
+                agendador.usar_triagem(len(reservadas), top_k)
+            if detectar_mudancas:
+                agendador.usar_deteccao_mudancas()
+        for acao in reservadas:
+            agendador.analisar(acao).add_done_callback(
+                lambda f, acao=acao: armazem.concluir(acao, f.result(), dia))
+
+        for acao, futuro in futuros.items():
+            acao_status[acao] = "Analisando" # Define o status da ação como "Analisando"
+            futuro.add_done_callback(
+                lambda f, acao=acao: _registrar_resultado(acao, f.result(), resultados, acao_status))
+        # Aguarda a conclusão de todas as ações sem polling
+        wait(futuros.values())
+        for acao, futuro in futuros.items():
+            _registrar_resultado(acao, futuro.result(), resultados, acao_status)
+    finally:
+        agendador.encerrar()
+        # Nunca deixa sessões esperando por uma ação reservada que não foi concluída
+        for acao in reservadas:
+            if not futuros[acao].done():
+                armazem.concluir(acao, {"erro": f"A análise da ação {acao} foi interrompida."}, dia)
+        analise_concluida.set() # Sinaliza que a análise foi concluída
@@ -0,0 +1,66 @@
+"""Screener em lote, sem interface: analisa uma lista de ações e grava os resultados.
+
+Exemplo (antes da abertura do pregão):
+
+    python screener.py --saida .cache/screener.jsonl --workers 8
+
+A interface do Streamlit reaproveita o arquivo de ``RICHBOT_SAIDA_SCREENER`` (por padrão
+``.cache/screener.jsonl``) quando ele é do pregão atual.
+"""
+import argparse
+import threading
+import time
+
+import pipeline
+
+
+def analisar_lista(acoes, workers, lote_ia=pipeline.MODO_LOTE_IA, top_k=pipeline.TOP_K_IA,
+                   detectar_mudancas=pipeline.DETECTAR_MUDANCAS):
+    """Roda o pipeline completo para as ações e devolve ({acao: resultado}, {acao: status})."""
+    resultados, acao_status = {}, {}
+    limites = {"dados": workers, "grafico": workers}
+    # Armazém próprio: o screener não reaproveita os resultados do pregão, só as análises
+    # das ações que não mudaram (a menos que a detecção de mudanças esteja desligada)
+    pipeline.iniciar_analise(acoes, resultados, acao_status, threading.Event(), limites=limites,
+                             lote_ia=lote_ia, armazem=pipeline.ArmazemResultados(), top_k=top_k,
+                             detectar_mudancas=detectar_mudancas)
+    return resultados, acao_status
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analisa ações da B3 sem a interface do Streamlit.")
+    parser.add_argument("--acoes", nargs="+", default=pipeline.acoes,
+                        help="Ações a analisar (padrão: a lista completa do app)")
+    parser.add_argument("--saida", default=pipeline.SAIDA_SCREENER,
+                        help="Arquivo de saída: .parquet ou .jsonl (padrão: %(default)s)")
+    parser.add_argument("--workers", type=int, default=pipeline.LIMITES_ETAPAS["dados"],
+                        help="Threads das etapas de dados e de gráfico (padrão: %(default)s)")
+    parser.add_argument("--lote-ia", action="store_true", default=pipeline.MODO_LOTE_IA,
+                        help="Envia várias ações por requisição ao Gemini")
+    parser.add_argument("--top-k", type=int, default=pipeline.TOP_K_IA,
+                        help="Envia à IA só as K ações mais bem pontuadas pela triagem (padrão: %(default)s, 0 = todas)")
+    parser.add_argument("--completo", action="store_true",
+                        help="Reanalisa todas as ações, mesmo as que não mudaram desde a última análise")
+    parser.add_argument("--metricas", nargs="?", const=pipeline.ARQUIVO_METRICAS, default=None,
+                        help="Grava a duração das etapas e os contadores em JSON (padrão: %(const)s)")
+    args = parser.parse_args(argv)
+
+    inicio = time.perf_counter()
+    resultados, acao_status = analisar_lista(args.acoes, args.workers, args.lote_ia, args.top_k,
+                                             pipeline.DETECTAR_MUDANCAS and not args.completo)
+    pipeline.salvar_resultados(resultados, args.saida)
+
+    erros = sum(status == "Erro" for status in acao_status.values())
+    fora = sum(status == pipeline.STATUS_FORA_DA_TRIAGEM for status in acao_status.values())
+    reaproveitadas = sum(status == pipeline.STATUS_SEM_MUDANCAS for status in acao_status.values())
+    print(f"{len(resultados)} ações analisadas ({erros} com erro, {fora} fora da triagem, "
+          f"{reaproveitadas} sem mudanças) "
+          f"em {time.perf_counter() - inicio:.1f}s; resultados gravados em {args.saida}")
+    if args.metricas:
+        print(pipeline.metricas.resumo().round(3).to_string(index=False))
+        print(f"Métricas gravadas em {pipeline.metricas.exportar(args.metricas)}")
+    return 1 if resultados and erros == len(resultados) else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
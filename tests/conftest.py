@@ -0,0 +1,8 @@
+"""Configuração comum dos testes: nenhum teste usa a rede nem o .cache do usuário."""
+import os
+import sys
+import tempfile
+
+# O diretório dos caches é lido na importação do pipeline
+os.environ.setdefault("RICHBOT_CACHE_DIR", tempfile.mkdtemp(prefix="richbot-testes-"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
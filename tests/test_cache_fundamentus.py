@@ -0,0 +1,84 @@
+"""Testes offline do CacheFundamentus lendo os snapshots de um diretório de fixtures."""
+import json
+import os
+
+import pytest
+
+import pipeline
+
+
+def gravar_fixture(diretorio, acao, cotacao):
+    dados = {}
+    for _, _, caminho in pipeline.CAMPOS_IA:
+        *intermediarios, folha = caminho
+        no = dados
+        for chave in intermediarios:
+            no = no.setdefault(chave, {})
+        no[folha] = 1.0
+    dados["price_information"]["price"] = cotacao
+    with open(os.path.join(diretorio, f"{acao}.json"), "w", encoding="utf-8") as arquivo:
+        json.dump(dados, arquivo)
+
+
+@pytest.fixture
+def fixtures(tmp_path):
+    diretorio = tmp_path / "fundamentus"
+    diretorio.mkdir()
+    return diretorio
+
+
+@pytest.fixture
+def cache(tmp_path, fixtures):
+    return pipeline.CacheFundamentus(str(tmp_path / "fundamentus.sqlite3"), diretorio_fixtures=str(fixtures))
+
+
+def test_le_a_fixture_e_depois_serve_do_disco(cache, fixtures):
+    gravar_fixture(fixtures, "PETR4", 38.5)
+    dados = cache.obter("PETR4")
+    assert dados["price_information"]["price"].value == 38.5
+    assert pipeline.preparar_dados_para_ia(dados, "PETR4").cotacao == 38.5
+
+    os.remove(fixtures / "PETR4.json")  # A segunda leitura não passa pela fixture
+    assert cache.obter("PETR4")["price_information"]["price"].value == 38.5
+    assert cache.estatisticas() == {"acertos": 1, "obsoletos": 0, "perdas": 1}
+
+
+def test_fixture_ausente_devolve_none(cache):
+    assert cache.obter("XXXX3") is None
+    assert cache.estatisticas()["perdas"] == 1
+
+
+def test_snapshot_de_pregao_anterior_e_atualizado(cache, fixtures, monkeypatch):
+    gravar_fixture(fixtures, "VALE3", 60.0)
+    monkeypatch.setattr(pipeline, "data_pregao", lambda agora=None: "2026-01-02")
+    cache.obter("VALE3")
+    monkeypatch.undo()
+
+    gravar_fixture(fixtures, "VALE3", 61.0)
+    assert cache.obter("VALE3")["price_information"]["price"].value == 61.0
+    assert cache.estatisticas() == {"acertos": 0, "obsoletos": 0, "perdas": 2}
+
+
+def test_snapshot_de_pregao_anterior_quando_a_busca_falha(cache, fixtures, monkeypatch):
+    gravar_fixture(fixtures, "ITUB4", 33.0)
+    monkeypatch.setattr(pipeline, "data_pregao", lambda agora=None: "2026-01-02")
+    cache.obter("ITUB4")
+    monkeypatch.undo()
+
+    os.remove(fixtures / "ITUB4.json")
+    assert cache.obter("ITUB4")["price_information"]["price"].value == 33.0
+    assert cache.estatisticas() == {"acertos": 0, "obsoletos": 1, "perdas": 1}
+
+
+def test_snapshot_vencido_do_pregao_atual_e_revalidado_em_segundo_plano(tmp_path, fixtures):
+    cache = pipeline.CacheFundamentus(str(tmp_path / "fundamentus.sqlite3"), ttl=0,
+                                      diretorio_fixtures=str(fixtures))
+    gravar_fixture(fixtures, "BBAS3", 27.0)
+    cache.obter("BBAS3")
+
+    gravar_fixture(fixtures, "BBAS3", 28.0)
+    assert cache.obter("BBAS3")["price_information"]["price"].value == 27.0  # Sem esperar a busca
+    cache._executor.shutdown(wait=True)
+    assert cache.estatisticas() == {"acertos": 0, "obsoletos": 1, "perdas": 1}
+    cache.ttl = 3600
+    assert cache.obter("BBAS3")["price_information"]["price"].value == 28.0
@@ -0,0 +1,94 @@
+"""Testes offline do cache de respostas do Gemini, com um modelo simulado no lugar do SDK."""
+from types import SimpleNamespace
+
+import pytest
+
+import pipeline
+
+RESPOSTA = 'Endividamento baixo.\n```json\n{"classificacao": "Negativo", "confianca": 0.6, "fatores": ["P/L alto"]}\n```'
+
+
+class ModeloSimulado:
+    """Qualquer objeto com ``generate_content`` serve de modelo."""
+
+    def __init__(self, model_name="modelo-simulado"):
+        self.model_name = model_name
+        self.prompts = []
+
+    def generate_content(self, prompt):
+        self.prompts.append(prompt)
+        return SimpleNamespace(text=RESPOSTA)
+
+
+def registro(acao="PETR4", cotacao=38.5):
+    campos = dict.fromkeys(pipeline.RegistroAcao._fields)
+    return pipeline.RegistroAcao(**{**campos, "acao": acao, "cotacao": cotacao})
+
+
+@pytest.fixture(autouse=True)
+def despachante(monkeypatch):
+    despachante = pipeline.DespachanteIA(requisicoes_por_minuto=60_000, rajada=100)
+    monkeypatch.setattr(pipeline, "despachante_ia", despachante)
+    return despachante
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return pipeline.CacheRespostasIA(str(tmp_path / "respostas_ia.sqlite3"))
+
+
+def test_dados_iguais_nao_chamam_o_modelo_de_novo(cache):
+    modelo = ModeloSimulado()
+    primeira = pipeline.enviar_analise_para_ia(registro(), modelo, cache)
+    segunda = pipeline.enviar_analise_para_ia(registro(), modelo, cache)
+    assert primeira == segunda == ("Endividamento baixo.", pipeline.Veredito("Negativo", 0.6, ["P/L alto"]))
+    assert len(modelo.prompts) == 1
+    assert cache.estatisticas() == {"acertos": 1, "perdas": 1}
+
+
+def test_dados_ou_modelo_diferentes_chamam_o_modelo(cache):
+    modelo = ModeloSimulado()
+    pipeline.enviar_analise_para_ia(registro(cotacao=38.5), modelo, cache)
+    pipeline.enviar_analise_para_ia(registro(cotacao=39.0), modelo, cache)
+    assert len(modelo.prompts) == 2
+
+    outro = ModeloSimulado("outro-modelo")
+    pipeline.enviar_analise_para_ia(registro(cotacao=38.5), outro, cache)
+    assert len(outro.prompts) == 1
+
+
+def test_modelo_global_substitui_o_cliente_do_gemini(cache, monkeypatch):
+    modelo = ModeloSimulado()
+    monkeypatch.setattr(pipeline, "model", modelo)
+    analise, veredito = pipeline.enviar_analise_para_ia(registro(), cache=cache)
+    assert analise == "Endividamento baixo."
+    assert veredito.classificacao == "Negativo"
+    assert len(modelo.prompts) == 1
+
+
+def test_cache_desativado(cache):
+    modelo = ModeloSimulado()
+    pipeline.enviar_analise_para_ia(registro(), modelo, cache=False)
+    pipeline.enviar_analise_para_ia(registro(), modelo, cache=False)
+    assert len(modelo.prompts) == 2
+    assert cache.estatisticas() == {"acertos": 0, "perdas": 0}
+
+
+def test_respostas_persistem_em_disco(cache):
+    modelo = ModeloSimulado()
+    pipeline.enviar_analise_para_ia(registro(), modelo, cache)
+    reaberto = pipeline.CacheRespostasIA(cache.caminho)
+    pipeline.enviar_analise_para_ia(registro(), modelo, reaberto)
+    assert len(modelo.prompts) == 1
+
+
+def test_descarta_as_menos_acessadas_e_as_vencidas(tmp_path):
+    cache = pipeline.CacheRespostasIA(str(tmp_path / "respostas_ia.sqlite3"), max_entradas=2)
+    veredito = pipeline.Veredito("Neutro", None, [])
+    for chave in ("a", "b", "c"):
+        cache.gravar(chave, "PETR4", "texto", veredito)
+    assert cache.obter("a") is None
+    assert cache.obter("c") == ("texto", veredito)
+
+    cache.ttl = 0
+    assert cache.obter("c") is None
@@ -0,0 +1,110 @@
+"""Testes offline do DespachanteIA: repetições, tempo esgotado e ritmo da cota."""
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import pipeline
+
+RESPOSTA = 'Fundamentos sólidos.\n```json\n{"classificacao": "Positivo", "confianca": 0.8, "fatores": ["ROE alto"]}\n```'
+
+
+class ErroHTTP(Exception):
+    def __init__(self, code):
+        super().__init__(f"Erro HTTP {code}")
+        self.code = code
+
+
+class ModeloInstavel:
+    """Falha com ``code`` nas ``falhas`` primeiras chamadas e depois responde."""
+
+    def __init__(self, falhas=0, code=429):
+        self.falhas = falhas
+        self.code = code
+        self.chamadas = 0
+
+    def generate_content(self, prompt):
+        self.chamadas += 1
+        if self.chamadas <= self.falhas:
+            raise ErroHTTP(self.code)
+        return SimpleNamespace(text=RESPOSTA)
+
+
+class ModeloTravado:
+    """Nunca responde dentro do prazo."""
+
+    def __init__(self):
+        self.chamadas = 0
+
+    async def generate_content_async(self, prompt):
+        self.chamadas += 1
+        await asyncio.sleep(60)
+
+
+def registro(acao="PETR4"):
+    return pipeline.RegistroAcao._make([acao] + [None] * (len(pipeline.RegistroAcao._fields) - 1))
+
+
+def despachante(**config):
+    config = {"requisicoes_por_minuto": 60_000, "rajada": 100, "timeout": 5, "max_tentativas": 5,
+              "espera_base": 0.01, "espera_maxima": 0.05, **config}
+    return pipeline.DespachanteIA(**config)
+
+
+def analisar(despachante, modelo, acao="PETR4"):
+    inicio = time.perf_counter()
+    analise, veredito = despachante.submeter(registro(acao), modelo, cache=False).result(timeout=30)
+    return analise, veredito, time.perf_counter() - inicio
+
+
+def test_repete_erros_de_cota_ate_responder():
+    d, modelo = despachante(), ModeloInstavel(falhas=3)
+    analise, veredito, duracao = analisar(d, modelo)
+    assert analise == "Fundamentos sólidos."
+    assert veredito.classificacao == "Positivo"
+    assert modelo.chamadas == 4
+    assert d.tentativas_repetidas == 3
+    assert duracao < 1  # Esperas de no máximo espera_maxima entre as tentativas
+
+
+def test_desiste_depois_de_max_tentativas():
+    d, modelo = despachante(max_tentativas=3), ModeloInstavel(falhas=10)
+    analise, erro, _ = analisar(d, modelo)
+    assert analise is None
+    assert "429" in erro
+    assert modelo.chamadas == 3
+    assert d.tentativas_repetidas == 2
+
+
+def test_nao_repete_erros_permanentes():
+    d, modelo = despachante(), ModeloInstavel(falhas=1, code=400)
+    analise, erro, _ = analisar(d, modelo)
+    assert analise is None
+    assert "400" in erro
+    assert modelo.chamadas == 1
+    assert d.tentativas_repetidas == 0
+
+
+def test_tempo_esgotado_e_repetido_e_respeita_o_timeout():
+    d, modelo = despachante(timeout=0.2, max_tentativas=2), ModeloTravado()
+    analise, erro, duracao = analisar(d, modelo)
+    assert analise is None
+    assert "TimeoutError" in erro
+    assert modelo.chamadas == 2
+    assert d.tentativas_repetidas == 1
+    assert 0.4 <= duracao < 1.5  # Dois prazos de 0,2 s, sem esperar o modelo travado
+
+
+@pytest.mark.parametrize("rajada", [1, 3])
+def test_balde_de_fichas_mantem_o_ritmo_da_cota(rajada):
+    # 600 requisições por minuto = uma ficha a cada 0,1 s, depois da rajada inicial
+    d, modelo = despachante(requisicoes_por_minuto=600, rajada=rajada, max_simultaneas=10), ModeloInstavel()
+    inicio = time.perf_counter()
+    futuros = [d.submeter(registro(f"A{i}"), modelo, cache=False) for i in range(6)]
+    for futuro in futuros:
+        assert futuro.result(timeout=30)[0] is not None
+    duracao = time.perf_counter() - inicio
+    minimo = (6 - rajada) * 0.1
+    assert minimo * 0.9 <= duracao < minimo + 1
+    assert d.tentativas_repetidas == 0